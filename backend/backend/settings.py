@@ -170,4 +170,69 @@ SIMPLE_JWT = {
 
 # CORS_ALLOW_ALL_ORIGINS = True
 
-AUTH_USER_MODEL = "receiptreader.User"
\ No newline at end of file
+AUTH_USER_MODEL = "receiptreader.User"
+
+# Receipt processing queue
+RECEIPT_PROCESSING_ASYNC = True
+RECEIPT_PROCESSING_WORKERS = 2
+RECEIPT_PROCESSING_MAX_ATTEMPTS = 3
+RECEIPT_PROCESSING_RETRY_DELAY = 5
+RECEIPT_BATCH_MAX_IMAGES = 20
+
+# Keyset pagination of receipt listings, only applied when the client sends cursor or page_size
+RECEIPT_PAGE_SIZE = 20
+RECEIPT_MAX_PAGE_SIZE = 100
+# Rows fetched per database round trip when a product listing is streamed with ?stream=1
+PRODUCT_STREAM_CHUNK_SIZE = 2000
+
+# Lets the front proxy send receipt images instead of Django: None streams them from Django,
+# 'x-accel-redirect' for nginx or 'x-sendfile' for Apache mod_xsendfile and lighttpd
+RECEIPT_IMAGE_SENDFILE = None
+# Internal nginx location aliased to MEDIA_ROOT, used with 'x-accel-redirect'
+RECEIPT_IMAGE_ACCEL_PREFIX = '/protected-media/'
+
+# Resized receipt images served by receipt-image with ?width= and ?image_format= (webp or jpeg), cached
+# in receipts/<unique_id>/derivatives/ and evicted least recently used beyond the byte budget
+RECEIPT_DERIVATIVE_WIDTHS = (160, 320, 640, 1280)
+RECEIPT_DERIVATIVE_FORMAT = 'webp'
+RECEIPT_DERIVATIVE_QUALITY = 80
+RECEIPT_DERIVATIVE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Process pool running preprocess() and Tesseract, 0 runs them in the calling thread
+RECEIPT_POOL_WORKERS = os.cpu_count() or 1
+RECEIPT_POOL_TASK_TIMEOUT = 120
+
+# OCR through 'pytesseract' (one tesseract process per image) or 'tesserocr' (one engine per worker
+# loaded once and fed pixels in memory), tesserocr falls back to pytesseract when not installed
+OCR_BACKEND = 'pytesseract'
+
+# Reads the text lines of a processed receipt in parallel, this many at a time, instead of OCRing the
+# whole image at once, 0 keeps whole-image OCR (see bench/bands.py). Every pool worker starts its own
+# readers, so keep RECEIPT_POOL_WORKERS * OCR_BAND_WORKERS near the number of cores
+OCR_BAND_WORKERS = 0
+
+# Crops the processed receipt to its text blocks before OCR so Tesseract skips empty paper and edge
+# noise, the stored processed image stays whole (see bench/text_region.py)
+OCR_CROP_TO_TEXT = False
+
+# Binarizes every receipt with each of these preprocessing.BINARIZE_VARIANTS in parallel, e.g.
+# ('combined', 'otsu', 'gaussian', 'combined_wide'), and keeps the text Tesseract read with the best
+# mean word confidence, empty runs preprocess() once. Every pool worker runs one Tesseract per
+# variant at once, or OCR_BAND_WORKERS when set, so mind RECEIPT_POOL_WORKERS
+OCR_BINARIZE_VARIANTS = ()
+
+# Prometheus scrapes /metrics with "Authorization: Bearer <METRICS_TOKEN>" or from an address in
+# METRICS_ALLOWED_IPS (the peer address, X-Forwarded-For is not trusted), neither set keeps it closed
+METRICS_TOKEN = os.environ.get('RECEIPT_METRICS_TOKEN')
+METRICS_ALLOWED_IPS = ()
+
+# Traces peak memory of every processing stage with tracemalloc, wall and CPU time are always recorded
+RECEIPT_PROFILE_MEMORY = False
+
+# Width at which preprocess() estimates the barcode, crop box and skew before applying them
+# to the full resolution photo, None keeps every step at full resolution (see bench/pyramid.py)
+RECEIPT_PREPROCESS_WORKING_WIDTH = None
+
+# Content-hash cache of processed images and OCR text, 0 disables it
+OCR_CACHE_DIR = BASE_DIR / 'cache' / 'ocr'
+OCR_CACHE_MAX_BYTES = 512 * 1024 * 1024
\ No newline at end of file
@@ -0,0 +1,181 @@
+#bench/__main__.py
+"""
+Throughput of the image pipeline on synthetic receipts of varying size, skew and noise.
+
+Every variant is processed repeat times after a warm-up run. The report covers latency percentiles,
+images per second and traced peak memory for the whole pipeline and for each profiled stage.
+Without --ocr the pipeline stops after preprocess(), so no Tesseract install is needed.
+Write the results with --json and pass that file to --compare on a later release to see the change.
+
+Usage:
+    python -m bench --sizes 900x1200 1500x2000 --skews 0 4 --noise 0 10 --repeat 5 --json before.json
+    python -m bench --ocr --working-width 1200 --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from typing import Callable, Optional
+
+import cv2
+import numpy as np
+import skimage
+
+from preprocessing import preprocess
+from profiling import call_profiled
+from bench.synthetic import synthetic_receipt
+from bench.utils import format_bytes, measure, parse_size, percentiles
+
+
+def environment(ocr: bool) -> dict:
+
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                  check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+
+    details = {
+        "revision": revision,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "scikit-image": skimage.__version__,
+    }
+    if ocr:
+        import pytesseract # type: ignore
+        details["tesseract"] = str(pytesseract.get_tesseract_version())
+    return details
+
+
+def pipeline_function(ocr: bool, language: str, working_width: Optional[int]) -> Callable:
+
+    if ocr:
+        # Importing the OCR side needs Tesseract, preprocessing alone does not.
+        from pipeline import process_image
+        return lambda image: process_image(image, language, working_width)
+    return lambda image: preprocess(image, working_width)
+
+
+def stage_totals(stages: list[dict], key: str) -> dict[str, float]:
+
+    # Stages such as downscale run more than once per image, report their total per image.
+    totals: dict[str, float] = defaultdict(float)
+    for record in stages:
+        totals[record["stage"]] += record[key]
+    return totals
+
+
+def run_variant(func: Callable, image: np.ndarray, repeat: int) -> dict:
+
+    call_profiled(False, func, image)
+
+    latencies = []
+    wall: dict[str, list[float]] = defaultdict(list)
+    cpu: dict[str, list[float]] = defaultdict(list)
+    for _ in range(repeat):
+        start = time.perf_counter()
+        _, stages = call_profiled(False, func, image)
+        latencies.append(time.perf_counter() - start)
+        for name, value in stage_totals(stages, "wall_seconds").items():
+            wall[name].append(value)
+        for name, value in stage_totals(stages, "cpu_seconds").items():
+            cpu[name].append(value)
+
+    # Memory is traced in a separate run, tracemalloc slows the timed runs down.
+    (_, traced_stages), _, peak = measure(call_profiled, True, func, image)
+    peaks: dict[str, int] = defaultdict(int)
+    for record in traced_stages:
+        peaks[record["stage"]] = max(peaks[record["stage"]], record["peak_bytes"])
+
+    return {
+        "pipeline": {
+            **percentiles(latencies),
+            "mean": statistics.fmean(latencies),
+            "images_per_second": 1 / statistics.fmean(latencies),
+            "peak_bytes": peak,
+        },
+        "stages": {
+            name: {**percentiles(wall[name]), "cpu_p50": percentiles(cpu[name], (50,))["p50"], "peak_bytes": peaks[name]}
+            for name in wall
+        },
+    }
+
+
+def compare(results: list[dict], baseline_path: str) -> None:
+
+    with open(baseline_path, encoding="utf-8") as baseline_file:
+        baseline = {result["name"]: result for result in json.load(baseline_file)["results"]}
+
+    print(f"\nChange of p50 against {baseline_path} (below 1.00x is faster)")
+    print(f"{'variant':<30} {'stage':<34} {'before ms':>10} {'after ms':>10} {'ratio':>7}")
+    for result in results:
+        before = baseline.get(result["name"])
+        if before is None:
+            continue
+        rows = [("pipeline", before["pipeline"], result["pipeline"])]
+        rows += [(name, before["stages"][name], stats) for name, stats in result["stages"].items() if name in before["stages"]]
+        for name, old, new in rows:
+            print(f"{result['name']:<30} {name:<34} {old['p50'] * 1000:>10.1f} {new['p50'] * 1000:>10.1f} "
+                  f"{new['p50'] / old['p50'] if old['p50'] else float('nan'):>6.2f}x")
+
+
+def main() -> None:
+
+    parser = argparse.ArgumentParser(prog="python -m bench", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", type=parse_size, default=[(900, 1200), (1500, 2000), (3000, 4000)])
+    parser.add_argument("--skews", nargs="+", type=float, default=[0.0, 4.0], help="Rotation of the paper in degrees.")
+    parser.add_argument("--noise", nargs="+", type=float, default=[0.0, 10.0], help="Standard deviation of pixel noise.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--working-width", type=int, default=None, help="Pyramid mode width passed to preprocess().")
+    parser.add_argument("--ocr", action="store_true", help="Run the full pipeline including PNG encoding and Tesseract.")
+    parser.add_argument("--language", default="pol")
+    parser.add_argument("--json", dest="json_path", help="Write the results to this file.")
+    parser.add_argument("--compare", help="Results file of an earlier run to compare against.")
+    args = parser.parse_args()
+
+    func = pipeline_function(args.ocr, args.language, args.working_width)
+
+    results = []
+    print(f"{'variant':<30} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'img/s':>7} {'peak':>11}  slowest stage")
+    for width, height in args.sizes:
+        for skew in args.skews:
+            for noise in args.noise:
+                name = f"{width}x{height} skew={skew:g} noise={noise:g}"
+                image = synthetic_receipt(width, height, skew=skew, noise=noise, seed=args.seed)
+                result = {"name": name, "size": [width, height], "skew": skew, "noise": noise,
+                          **run_variant(func, image, args.repeat)}
+                results.append(result)
+
+                stats = result["pipeline"]
+                top_level = {stage: values for stage, values in result["stages"].items() if "." not in stage}
+                slowest = max(top_level, key=lambda stage: top_level[stage]["p50"], default="")
+                print(f"{name:<30} {stats['p50'] * 1000:>8.1f} {stats['p90'] * 1000:>8.1f} {stats['p99'] * 1000:>8.1f} "
+                      f"{stats['images_per_second']:>7.2f} {format_bytes(stats['peak_bytes']):>11}  {slowest}")
+
+    if args.json_path:
+        report = {
+            "environment": environment(args.ocr),
+            "settings": {"repeat": args.repeat, "seed": args.seed, "working_width": args.working_width,
+                         "ocr": args.ocr, "language": args.language},
+            "results": results,
+        }
+        with open(args.json_path, "w", encoding="utf-8") as json_file:
+            json.dump(report, json_file, indent=2)
+        print(f"Results written to {args.json_path}", file=sys.stderr)
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
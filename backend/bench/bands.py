@@ -0,0 +1,86 @@
+#bench/bands.py
+"""
+Latency of whole-image OCR against band OCR (imagemaneger.bands_to_text) on long receipts.
+
+Every receipt is preprocessed once, then its binary image is read whole and band by band with
+each number of workers. Similarity is the difflib ratio of the band text to the whole-image text.
+--segment-only reports the bands found by find_text_bands without running Tesseract.
+
+Usage:
+    python -m bench.bands --lines 40 120 --workers 1 2 4 --repeat 3
+    python -m bench.bands --images receipts/*/p1.png --segment-only
+"""
+import argparse
+import difflib
+import os
+import statistics
+
+import cv2
+import numpy as np
+
+from preprocessing import find_text_bands, preprocess
+from bench.pyramid import receipt_images
+from bench.synthetic import synthetic_receipt
+from bench.utils import measure
+
+LINE_HEIGHT = 28
+RECEIPT_WIDTH = 1000
+
+
+def long_receipt(lines: int, seed: int = 0) -> np.ndarray:
+
+    # synthetic_receipt draws a line every 1.6 line heights on paper covering 84% of the height,
+    # leaving three line steps free around the text.
+    height = int((lines + 3) * LINE_HEIGHT * 1.6 / 0.84)
+    return synthetic_receipt(RECEIPT_WIDTH, height, skew=1.5, noise=6, seed=seed, line_height=LINE_HEIGHT)
+
+
+def inputs(args) -> list[tuple[str, np.ndarray]]:
+
+    images = [(f"synthetic {lines} lines", long_receipt(lines, args.seed)) for lines in args.lines]
+    for path in receipt_images(args.images):
+        image = cv2.imread(path)
+        if image is not None:
+            images.append((os.path.basename(path), image))
+    return images
+
+
+def main() -> None:
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", nargs="+", type=int, default=[40, 120], help="Lines of the synthetic receipts.")
+    parser.add_argument("--images", nargs="*", default=[], help="Glob patterns of receipt photos.")
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--language", default="pol")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--segment-only", action="store_true", help="Only time find_text_bands, no Tesseract needed.")
+    args = parser.parse_args()
+
+    if not args.segment_only:
+        # Importing imagemaneger asks Tesseract for its languages.
+        from imagemaneger import bands_to_text, image_to_text
+
+    print(f"{'receipt':<28} {'size':>11} {'bands':>6} {'segment ms':>11} {'mode':>10} {'ms':>9} {'speedup':>8} {'similar':>8}")
+    for name, image in inputs(args):
+        binary = preprocess(image)
+        bands, times, _ = measure(find_text_bands, binary, repeat=args.repeat)
+        size = f"{binary.shape[1]}x{binary.shape[0]}"
+        print(f"{name[:28]:<28} {size:>11} {len(bands):>6} {statistics.median(times) * 1000:>11.1f}")
+        if args.segment_only:
+            continue
+
+        whole_text, times, _ = measure(image_to_text, binary, args.language, repeat=args.repeat)
+        whole_time = statistics.median(times)
+        print(f"{'':<28} {'':>11} {'':>6} {'':>11} {'whole':>10} {whole_time * 1000:>9.0f} {'1.00x':>8} {'':>8}")
+
+        for workers in args.workers:
+            text, times, _ = measure(bands_to_text, binary, args.language, workers, repeat=args.repeat)
+            elapsed = statistics.median(times)
+            similarity = difflib.SequenceMatcher(None, whole_text, text).ratio()
+            print(f"{'':<28} {'':>11} {'':>6} {'':>11} {f'bands x{workers}':>10} {elapsed * 1000:>9.0f} "
+                  f"{whole_time / elapsed:>7.2f}x {similarity:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+#bench/masks.py
+"""
+Compares the fused binarize() with the original composition of gaussian_mask, otsu_mask,
+open_binary_image and add_and_average, reporting time and peak NumPy allocations.
+
+Usage:
+    python -m bench.masks --images receipts/*/p1.png --repeat 5
+    python -m bench.masks --sizes 1500x2000 3000x4000
+"""
+import argparse
+import statistics
+
+import cv2
+import numpy as np
+
+from preprocessing import add_and_average, binarize, crop_image, gaussian_mask, open_binary_image, otsu_mask
+from bench.pyramid import receipt_images
+from bench.synthetic import synthetic_receipt
+from bench.utils import format_bytes, measure, parse_size
+
+
+def legacy_binarize(image):
+
+    gaussian_image = open_binary_image(gaussian_mask(image), (3, 3), (2, 2))
+    otsu_image = open_binary_image(otsu_mask(image), (3, 3), (2, 2))
+    return open_binary_image(add_and_average(otsu_image, gaussian_image), (2, 2), (2, 2))
+
+
+def inputs(args) -> list[tuple[str, np.ndarray]]:
+
+    images = [(f"{width}x{height}", synthetic_receipt(width, height)) for width, height in args.sizes]
+    for path in receipt_images(args.images):
+        image = cv2.imread(path)
+        if image is not None:
+            images.append((path, crop_image(image)))
+    return images
+
+
+def main() -> None:
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", nargs="*", default=[], help="Receipt photos, cropped before binarizing.")
+    parser.add_argument("--sizes", nargs="*", type=parse_size, default=[(1500, 2000)],
+                        help="Synthetic receipt sizes as WIDTHxHEIGHT.")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'image':>40} {'legacy ms':>10} {'fused ms':>9} {'legacy peak':>12} {'fused peak':>11}")
+    for name, image in inputs(args):
+        legacy, legacy_times, legacy_peak = measure(legacy_binarize, image, repeat=args.repeat)
+        fused, fused_times, fused_peak = measure(binarize, image, repeat=args.repeat)
+
+        if not np.array_equal(legacy, fused):
+            raise AssertionError(f"Fused binarize differs from the original on {name}")
+
+        print(f"{name[-40:]:>40} {statistics.median(legacy_times) * 1000:>10.1f} "
+              f"{statistics.median(fused_times) * 1000:>9.1f} {format_bytes(legacy_peak):>12} "
+              f"{format_bytes(fused_peak):>11}")
+
+
+if __name__ == "__main__":
+    main()
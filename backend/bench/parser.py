@@ -0,0 +1,124 @@
+#bench/parser.py
+"""
+Parse throughput of receiptreader.utils.parse_receipt_text on synthetic OCR output, compared with
+the original two-search implementation. Both must return the same products for the corpus.
+
+Usage:
+    python -m bench.parser --lines 1000 100000 --repeat 5
+"""
+import argparse
+import logging
+import random
+import re
+import statistics
+import time
+from decimal import Decimal, InvalidOperation
+
+from receiptreader.utils import iter_receipt_products, parse_receipt_text
+
+NAMES = ["Pizza Bufala", "Mleko 3,2%", "Chleb razowy", "Soda", "Jaja L 10szt", "Ser gouda", "Woda mineralna 1,5L"]
+CATEGORIES = ["Food", "Drink", "Dairy", "Bakery", "Household"]
+
+
+def legacy_parse_receipt_text(receipt_text):
+    products = []
+    lines = receipt_text.strip().split("\n")
+
+    for line in lines:
+        try:
+            category_match = re.search(r"##(.+?)##", line)
+            category = category_match.group(1).strip() if category_match else "Uncategorized"
+            if category_match:
+                line = line.replace(category_match.group(0), "").strip()
+
+            price_match = re.search(r"&&([\d.,]+)&&", line)
+            price = Decimal(price_match.group(1).replace(",", ".")) if price_match else Decimal(0.00)
+            if price_match:
+                line = line.replace(price_match.group(0), "").strip()
+
+            name = line.strip()
+            if not name:
+                name = "Unnamed Product"
+
+            if price_match and (price < 0 or price > 200000):
+                raise ValueError(f"Price {price} is invalid.")
+
+            products.append({
+                "name": name,
+                "price": price,
+                "category": category
+            })
+
+        except (InvalidOperation, ValueError):
+            continue
+
+    return products
+
+
+def synthetic_ocr_text(lines: int, seed: int = 0) -> str:
+    """
+    Receipt lines in the annotated format, with the usual OCR damage: missing markers,
+    comma decimals, stray characters, broken and implausible prices.
+    """
+    rng = random.Random(seed)
+    output = []
+    for _ in range(lines):
+        name = rng.choice(NAMES)
+        price = f"{rng.randint(0, 300)}.{rng.randint(0, 99):02d}"
+        category = rng.choice(CATEGORIES)
+        damage = rng.random()
+
+        if damage < 0.05:
+            output.append(name)
+        elif damage < 0.10:
+            output.append(f"{name} &&{price.replace('.', ',')}&& ##{category}##")
+        elif damage < 0.13:
+            output.append(f"{name} &&{price}.1&& ##{category}##")
+        elif damage < 0.15:
+            output.append(f"{name} &&9999999&& ##{category}##")
+        elif damage < 0.18:
+            output.append(f"##{category}## {name} # &&{price}&&")
+        else:
+            output.append(f"{name} &&{price}&& ##{category}##")
+    return "\n".join(output)
+
+
+def throughput(func, text: str, lines: int, repeat: int) -> float:
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(text)
+        timings.append(time.perf_counter() - start)
+    return lines / statistics.median(timings)
+
+
+def main() -> None:
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", nargs="+", type=int, default=[1000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    implementations = [
+        ("legacy", legacy_parse_receipt_text),
+        ("list", parse_receipt_text),
+        ("generator", lambda text: sum(1 for _ in iter_receipt_products(text))),
+    ]
+
+    print(f"{'lines':>8} {'impl':>10} {'lines/s':>12} {'speedup':>8}")
+    for lines in args.lines:
+        text = synthetic_ocr_text(lines)
+        if parse_receipt_text(text) != legacy_parse_receipt_text(text):
+            raise AssertionError("Parsers disagree on the synthetic corpus")
+
+        baseline = None
+        for name, func in implementations:
+            rate = throughput(func, text, lines, args.repeat)
+            baseline = baseline or rate
+            print(f"{lines:>8} {name:>10} {rate:>12,.0f} {rate / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
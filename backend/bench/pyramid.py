@@ -0,0 +1,108 @@
+#bench/pyramid.py
+"""
+Accuracy versus speed of the pyramid mode of preprocessing.preprocess.
+
+For every test receipt it runs the full resolution pipeline and the pyramid pipeline at each
+working width, reporting the time, the estimated skew angle and how many pixels of the binary
+output agree with the full resolution result.
+
+Usage:
+    python -m bench.pyramid --widths 800 1200 --images receipts/*/p1.png
+"""
+import argparse
+import glob
+import os
+import statistics
+
+import cv2
+import numpy as np
+
+from preprocessing import (binarize, crop_image, crop_above_barcode, crop_to_receipt, detect_barcode, downscale,
+                           estimate_skew, find_barcode, find_receipt_box, preprocess, scale_box)
+from bench.utils import measure
+
+DEFAULT_IMAGES = "receipts/*/*"
+
+
+def receipt_images(patterns: list[str]) -> list[str]:
+
+    paths = sorted({path for pattern in patterns for path in glob.glob(pattern)})
+    return [path for path in paths if path.lower().endswith((".jpg", ".jpeg", ".png"))
+            and not os.path.basename(path).startswith("processed_")]
+
+
+def full_resolution_angle(image) -> float:
+
+    angle = estimate_skew(binarize(crop_image(detect_barcode(image))))
+    return angle or 0.0
+
+
+def pyramid_angle(image, working_width: int) -> float:
+
+    small_image, scale = downscale(image, working_width)
+    barcode = find_barcode(small_image)
+    if barcode is not None:
+        image = crop_above_barcode(image, scale_box(barcode, scale))
+        small_image, scale = downscale(image, working_width)
+    box = find_receipt_box(small_image)
+    cropped_image = image if box is None else crop_to_receipt(image, scale_box(box, scale))
+
+    angle = estimate_skew(downscale(binarize(cropped_image), working_width)[0])
+    return angle or 0.0
+
+
+def agreement(reference, result) -> float:
+
+    if reference.shape != result.shape:
+        height = min(reference.shape[0], result.shape[0])
+        width = min(reference.shape[1], result.shape[1])
+        reference, result = reference[:height, :width], result[:height, :width]
+    return float(np.mean(reference == result))
+
+
+def main() -> None:
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", nargs="+", default=[DEFAULT_IMAGES], help="Glob patterns of receipt photos.")
+    parser.add_argument("--widths", nargs="+", type=int, default=[800, 1000, 1200, 1600])
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    paths = receipt_images(args.images)
+    if not paths:
+        parser.error("No receipt images found")
+
+    speedups = {width: [] for width in args.widths}
+    angle_errors = {width: [] for width in args.widths}
+
+    print(f"{'image':<32} {'width':>6} {'ms':>8} {'speedup':>8} {'angle':>7} {'|err|':>6} {'agree':>7}")
+    for path in paths:
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        name = os.path.basename(path)[:32]
+
+        reference, times, _ = measure(preprocess, image, repeat=args.repeat)
+        reference_time = statistics.median(times)
+        reference_angle = full_resolution_angle(image)
+        print(f"{name:<32} {'full':>6} {reference_time * 1000:>8.0f} {'1.00x':>8} {reference_angle:>7.2f} {'':>6} {'':>7}")
+
+        for width in args.widths:
+            result, times, _ = measure(preprocess, image, width, repeat=args.repeat)
+            elapsed = statistics.median(times)
+            angle = pyramid_angle(image, width)
+
+            speedups[width].append(reference_time / elapsed)
+            angle_errors[width].append(abs(angle - reference_angle))
+            print(f"{'':<32} {width:>6} {elapsed * 1000:>8.0f} {reference_time / elapsed:>7.2f}x "
+                  f"{angle:>7.2f} {abs(angle - reference_angle):>6.2f} {agreement(reference, result):>7.1%}")
+
+    print()
+    print(f"{'width':>6} {'median speedup':>15} {'median |err|':>13} {'max |err|':>10}")
+    for width in args.widths:
+        print(f"{width:>6} {statistics.median(speedups[width]):>14.2f}x "
+              f"{statistics.median(angle_errors[width]):>13.2f} {max(angle_errors[width]):>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+#bench/rle.py
+"""
+Compares the NumPy run-length encoder behind image_to_json/json_to_image with the
+original character-by-character compress_binary_string/decompress_binary_string.
+
+Usage:
+    python -m bench.rle --sizes 750x1000 1500x2000 --repeat 3
+"""
+import argparse
+import json
+import statistics
+
+import numpy as np
+
+from imagemaneger import compress_binary_string, decompress_binary_string, image_to_json, json_to_image
+from bench.synthetic import synthetic_binary_receipt
+from bench.utils import format_bytes, measure, parse_size
+
+
+def legacy_image_to_json(image) -> str:
+
+    (height, width) = image.shape[:2]
+    return json.dumps({"image": compress_binary_string(image.tobytes().hex()), "height": height, "width": width})
+
+
+def legacy_json_to_image(json_string: str):
+
+    load = json.loads(json_string)
+    return np.array(decompress_binary_string(load["image"]), dtype=np.uint8).reshape((load["height"], load["width"]))
+
+
+def main() -> None:
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", type=parse_size, default=[(750, 1000), (1500, 2000)],
+                        help="Image sizes as WIDTHxHEIGHT.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--skip-legacy", action="store_true", help="Only measure the NumPy encoder.")
+    args = parser.parse_args()
+
+    implementations = [("numpy", image_to_json, json_to_image)]
+    if not args.skip_legacy:
+        implementations.append(("legacy", legacy_image_to_json, legacy_json_to_image))
+
+    print(f"{'size':>11} {'impl':>7} {'encode ms':>10} {'decode ms':>10} {'payload':>11} {'peak mem':>11}")
+    for width, height in args.sizes:
+        image = synthetic_binary_receipt(width, height)
+
+        for name, encode, decode in implementations:
+            payload, encode_times, encode_peak = measure(encode, image, repeat=args.repeat)
+            decoded, decode_times, decode_peak = measure(decode, payload, repeat=args.repeat)
+
+            if name == "numpy" and not np.array_equal(decoded, image):
+                raise AssertionError("Decoded image differs from the original")
+
+            print(f"{width}x{height:<6} {name:>7} {statistics.median(encode_times) * 1000:>10.1f} "
+                  f"{statistics.median(decode_times) * 1000:>10.1f} {format_bytes(len(payload)):>11} "
+                  f"{format_bytes(max(encode_peak, decode_peak)):>11}")
+
+
+if __name__ == "__main__":
+    main()
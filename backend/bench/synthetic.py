@@ -0,0 +1,62 @@
+#bench/synthetic.py
+import cv2
+from cv2.typing import MatLike
+import numpy as np
+from typing import Optional
+
+BACKGROUND_LEVEL = 70
+PAPER_MARGIN = 0.08
+LINE_HEIGHT = 0.018
+
+
+def synthetic_receipt(width: int = 1500, height: int = 2000, skew: float = 0.0,
+                      noise: float = 0.0, seed: int = 0, line_height: Optional[float] = None) -> MatLike:
+    """
+    Draws a receipt-like BGR photo: a white paper strip with lines of text on a darker background.
+
+    Parameters:
+        width (int): Width of the photo in pixels.
+        height (int): Height of the photo in pixels.
+        skew (float): Rotation of the paper in degrees.
+        noise (float): Standard deviation of the Gaussian noise added to every pixel.
+        seed (int): Seed of the random text and noise.
+        line_height (float): Height of a line of text in pixels, by default a fixed share of the height.
+            Set it to draw long receipts with many lines.
+
+    Returns:
+        MatLike: The generated photo.
+    """
+    rng = np.random.default_rng(seed)
+    image = np.full((height, width, 3), BACKGROUND_LEVEL, dtype=np.uint8)
+
+    left, right = int(width * 0.2), int(width * 0.8)
+    top, bottom = int(height * PAPER_MARGIN), int(height * (1 - PAPER_MARGIN))
+    cv2.rectangle(image, (left, top), (right, bottom), (250, 250, 250), thickness=-1)
+
+    line_height = height * LINE_HEIGHT if line_height is None else line_height
+    line_step = max(int(line_height * 1.6), 8)
+    font_scale = line_height / 22
+    thickness = max(int(font_scale * 2), 1)
+    for y in range(top + 2 * line_step, bottom - line_step, line_step):
+        name = "".join(rng.choice(list("ABCDEFGHIJKLMNOPRSTUWZ "), size=int(rng.integers(6, 18))))
+        price = f"{rng.integers(1, 99)},{rng.integers(0, 99):02d} C"
+        cv2.putText(image, name, (left + line_step, y), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (20, 20, 20), thickness)
+        (price_width, _), _ = cv2.getTextSize(price, cv2.FONT_HERSHEY_SIMPLEX, font_scale, thickness)
+        cv2.putText(image, price, (right - line_step - price_width, y), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (20, 20, 20), thickness)
+
+    if skew:
+        matrix = cv2.getRotationMatrix2D((width // 2, height // 2), skew, 1.0)
+        image = cv2.warpAffine(image, matrix, (width, height), flags=cv2.INTER_LINEAR,
+                               borderMode=cv2.BORDER_CONSTANT, borderValue=(BACKGROUND_LEVEL,) * 3)
+
+    if noise:
+        image = np.clip(image + rng.normal(0, noise, image.shape), 0, 255).astype(np.uint8)
+
+    return image
+
+
+def synthetic_binary_receipt(width: int = 1500, height: int = 2000, seed: int = 0) -> MatLike:
+
+    gray = cv2.cvtColor(synthetic_receipt(width, height, seed=seed), cv2.COLOR_BGR2GRAY)
+    _, binary = cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY)
+    return binary
@@ -0,0 +1,79 @@
+#bench/text_region.py
+"""
+Share of pixels cropped away by preprocessing.crop_to_text and the OCR speedup it buys.
+
+Every receipt is preprocessed once, then its binary image is cropped to the text region and, unless
+--crop-only is given, read by Tesseract whole and cropped. Similarity is the difflib ratio of the
+cropped text to the whole-image text.
+
+Usage:
+    python -m bench.text_region --images "receipts/*/p1.png" --repeat 3
+    python -m bench.text_region --images "receipts/*/processed_*" --preprocessed --crop-only
+"""
+import argparse
+import difflib
+import glob
+import os
+import statistics
+
+import cv2
+
+from preprocessing import crop_to_text, preprocess
+from bench.bands import long_receipt
+from bench.pyramid import receipt_images
+from bench.utils import measure
+
+
+def main() -> None:
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", nargs="*", type=int, default=[40], help="Lines of the synthetic receipts.")
+    parser.add_argument("--images", nargs="*", default=[], help="Glob patterns of receipt photos.")
+    parser.add_argument("--preprocessed", action="store_true", help="The images already are processed receipts.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--language", default="pol")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--crop-only", action="store_true", help="Only time crop_to_text, no Tesseract needed.")
+    args = parser.parse_args()
+
+    if not args.crop_only:
+        # Importing imagemaneger asks Tesseract for its languages.
+        from imagemaneger import image_to_text
+
+    images = [(f"synthetic {lines} lines", preprocess(long_receipt(lines, args.seed))) for lines in args.lines]
+    # receipt_images() skips processed_* files, which are exactly the inputs of --preprocessed.
+    paths = sorted({path for pattern in args.images for path in glob.glob(pattern)}) if args.preprocessed \
+        else receipt_images(args.images)
+    for path in paths:
+        image = cv2.imread(path, cv2.IMREAD_GRAYSCALE if args.preprocessed else cv2.IMREAD_COLOR)
+        if image is not None:
+            images.append((os.path.basename(path), image if args.preprocessed else preprocess(image)))
+
+    eliminated_fractions = []
+    speedups = []
+    print(f"{'receipt':<28} {'size':>11} {'cropped':>11} {'eliminated':>11} {'find ms':>8} "
+          f"{'whole ms':>9} {'text ms':>9} {'speedup':>8} {'similar':>8}")
+    for name, binary in images:
+        (cropped, eliminated, _), times, _ = measure(crop_to_text, binary, repeat=args.repeat)
+        eliminated_fractions.append(eliminated)
+        row = (f"{name[:28]:<28} {f'{binary.shape[1]}x{binary.shape[0]}':>11} "
+               f"{f'{cropped.shape[1]}x{cropped.shape[0]}':>11} {eliminated:>10.1%} {statistics.median(times) * 1000:>8.1f}")
+        if args.crop_only:
+            print(row)
+            continue
+
+        whole_text, times, _ = measure(image_to_text, binary, args.language, repeat=args.repeat)
+        whole_time = statistics.median(times)
+        text, times, _ = measure(image_to_text, cropped, args.language, repeat=args.repeat)
+        cropped_time = statistics.median(times)
+        speedups.append(whole_time / cropped_time)
+        similarity = difflib.SequenceMatcher(None, whole_text, text).ratio()
+        print(f"{row} {whole_time * 1000:>9.0f} {cropped_time * 1000:>9.0f} {whole_time / cropped_time:>7.2f}x {similarity:>8.2f}")
+
+    if eliminated_fractions:
+        print(f"\nMedian eliminated {statistics.median(eliminated_fractions):.1%}", end="")
+        print(f", median OCR speedup {statistics.median(speedups):.2f}x" if speedups else "")
+
+
+if __name__ == "__main__":
+    main()
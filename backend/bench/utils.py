@@ -0,0 +1,49 @@
+#bench/utils.py
+import time
+import tracemalloc
+from typing import Any, Callable
+
+import numpy as np
+
+
+def measure(func: Callable, *args, repeat: int = 1) -> tuple[Any, list[float], int]:
+    """
+    Calls func repeatedly, timing every call and tracking the peak of Python/NumPy allocations.
+
+    Returns:
+        tuple: Result of the last call, list of wall times in seconds and peak allocated bytes.
+    """
+    timings = []
+    result = None
+    tracemalloc.start()
+    try:
+        for _ in range(repeat):
+            tracemalloc.reset_peak()
+            start = time.perf_counter()
+            result = func(*args)
+            timings.append(time.perf_counter() - start)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return result, timings, peak
+
+
+def format_bytes(size: float) -> str:
+
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
+
+def parse_size(value: str) -> tuple[int, int]:
+
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def percentiles(values: list[float], points: tuple[int, ...] = (50, 90, 99)) -> dict[str, float]:
+
+    return {f"p{point}": float(value) for point, value in zip(points, np.percentile(values, points))}
@@ -1,16 +1,35 @@
 #imagemanager.py
+import base64
 import json
 import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
 
 import cv2
 from cv2.typing import MatLike
 import numpy as np
-import pytesseract # type: ignore
 
+from ocr_backends import available_languages, image_to_data, image_to_string
+from ocr_words import stack_lines
+from preprocessing import find_text_bands
+from profiling import in_context, profiled_stage
 
-SUPPORTED_LANGUAGES = pytesseract.get_languages()
+
+SUPPORTED_LANGUAGES = available_languages()
 SUPPORTED_IMAGE_EXTENSIONS = [".jpg", ".jpeg", ".png", ".bmp", ".gif"]
 COMPRESSION_DELIMITER = "|"
+RUN_LENGTH_ENCODING = "rle"
+LEGACY_RUN_PATTERN = re.compile(rf"\{COMPRESSION_DELIMITER}(\d+)([0f])")
+# Tesseract page segmentation modes for a single line of text and for a uniform block of text
+PSM_SINGLE_LINE = 7
+PSM_SINGLE_BLOCK = 6
+# Text bands taller than this multiple of the median band height hold more than one line
+MULTI_LINE_BAND = 1.8
+
+_band_executors: dict[int, ThreadPoolExecutor] = {}
+_band_executors_lock = threading.Lock()
 
 
 def show_image(image: MatLike) -> None:
@@ -57,18 +76,93 @@ def save_image(file_path: str, image: MatLike) -> None:
         raise ValueError(f"Error while trying to save image to: {file_path}\nError: {str(error)}") from error
 
 
-def image_to_text(image: MatLike, language: str = 'pol') -> str:
+@profiled_stage
+def image_to_text(image: MatLike, language: str = 'pol', psm: Optional[int] = None) -> str:
 
     if language not in SUPPORTED_LANGUAGES:
         raise ValueError(f"Unsupported language for OCR: {language}")
 
     try:
-        return pytesseract.image_to_string(image, lang=language)
+        return image_to_string(image, language, psm)
 
     except Exception as error:
         raise Exception(f"Error while using Tesseract:\nError: {str(error)}") from error
 
 
+@profiled_stage
+def image_to_words(image: MatLike, language: str = 'pol', psm: Optional[int] = None) -> dict[str, np.ndarray]:
+    """
+    Reads the words of an image into columns, see ocr_words.parse_tsv().
+    """
+    if language not in SUPPORTED_LANGUAGES:
+        raise ValueError(f"Unsupported language for OCR: {language}")
+
+    try:
+        return image_to_data(image, language, psm)
+
+    except Exception as error:
+        raise Exception(f"Error while using Tesseract:\nError: {str(error)}") from error
+
+
+def band_parameters() -> dict:
+
+    return {"band_psm": [PSM_SINGLE_LINE, PSM_SINGLE_BLOCK], "multi_line_band": MULTI_LINE_BAND}
+
+
+def band_executor(workers: int) -> ThreadPoolExecutor:
+
+    # The threads live as long as the process, so bands of every receipt and variant share them and their engines.
+    with _band_executors_lock:
+        executor = _band_executors.get(workers)
+        if executor is None:
+            executor = _band_executors[workers] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ocr-band")
+        return executor
+
+
+def read_bands(image: MatLike, bands: list[tuple[int, int]], read: Callable, workers: int) -> list:
+
+    # A band holding one line skips Tesseract's layout analysis, taller bands are read as a uniform block.
+    line_height = MULTI_LINE_BAND * float(np.median([bottom - top for top, bottom in bands]))
+
+    def read_band(band: tuple[int, int]):
+        top, bottom = band
+        psm = PSM_SINGLE_LINE if bottom - top <= line_height else PSM_SINGLE_BLOCK
+        return read(image[top:bottom], psm)
+
+    try:
+        return list(band_executor(max(workers, 1)).map(in_context(read_band), bands))
+
+    except Exception as error:
+        raise Exception(f"Error while reading text bands:\nError: {str(error)}") from error
+
+
+@profiled_stage
+def bands_to_text(image: MatLike, language: str = 'pol', workers: int = 2) -> str:
+    """
+    OCRs every text band of a binary receipt on its own, workers bands at a time, and joins the text top to bottom.
+    """
+    bands = find_text_bands(image)
+    # Nothing looks like a line, so Tesseract's own layout analysis gets the whole image.
+    if not bands:
+        return image_to_text(image, language)
+
+    texts = read_bands(image, bands, lambda band, psm: image_to_text(band, language, psm), workers)
+    return "\n".join(line for text in texts for line in text.splitlines() if line.strip())
+
+
+@profiled_stage
+def bands_to_words(image: MatLike, language: str = 'pol', workers: int = 2) -> dict[str, np.ndarray]:
+    """
+    Same as bands_to_text(), but returns the words of the bands in image coordinates.
+    """
+    bands = find_text_bands(image)
+    if not bands:
+        return image_to_words(image, language)
+
+    parts = read_bands(image, bands, lambda band, psm: image_to_words(band, language, psm), workers)
+    return stack_lines(parts, [top for top, _ in bands])
+
+
 def image_to_text_file(image: MatLike, language: str, save_path: str, save_filename: str) -> bool:
 
     try:
@@ -124,6 +218,69 @@ def decompress_binary_string(encoded_data: str) -> list[str]:
         raise Exception(f"Error while decompressing binary string:\n{str(error)}") from error
 
 
+def encode_runs(image: MatLike) -> dict:
+
+    try:
+        flat = np.ascontiguousarray(image, dtype=np.uint8).ravel()
+        if flat.size == 0:
+            raise ValueError("Image is empty.")
+
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(flat)) + 1))
+        lengths = np.diff(np.append(starts, flat.size))
+        values = flat[starts]
+        run_dtype = np.dtype(np.min_scalar_type(int(lengths.max()))).newbyteorder("<")
+
+        payload = {
+            "encoding": RUN_LENGTH_ENCODING,
+            "run_dtype": run_dtype.str,
+            "runs": base64.b64encode(lengths.astype(run_dtype).tobytes()).decode("ascii"),
+        }
+
+        # Neighbouring runs always differ, so a two level image alternates and only needs its first two values.
+        if np.unique(values).size <= 2:
+            payload["levels"] = values[:2].tolist()
+        else:
+            payload["values"] = base64.b64encode(values.tobytes()).decode("ascii")
+
+        return payload
+
+    except Exception as error:
+        raise Exception(f"Error while encoding image runs:\n{str(error)}") from error
+
+
+def decode_runs(payload: dict, height: int, width: int) -> MatLike:
+
+    try:
+        lengths = np.frombuffer(base64.b64decode(payload["runs"]), dtype=np.dtype(payload["run_dtype"]))
+
+        if "levels" in payload:
+            values = np.resize(np.array(payload["levels"], dtype=np.uint8), lengths.size)
+        else:
+            values = np.frombuffer(base64.b64decode(payload["values"]), dtype=np.uint8)
+
+        if values.size != lengths.size or int(lengths.sum()) != height * width:
+            raise ValueError("Run lengths do not match the image dimensions.")
+
+        return np.repeat(values, lengths).reshape((height, width))
+
+    except Exception as error:
+        raise Exception(f"Error while decoding image runs:\n{str(error)}") from error
+
+
+def decode_legacy_runs(encoded_data: str, height: int, width: int) -> MatLike:
+
+    try:
+        runs = np.array(LEGACY_RUN_PATTERN.findall(encoded_data))
+        if runs.size == 0:
+            raise ValueError("No runs found in legacy image data.")
+
+        values = np.where(runs[:, 1] == "f", 255, 0).astype(np.uint8)
+        return np.repeat(values, runs[:, 0].astype(np.int64)).reshape((height, width))
+
+    except Exception as error:
+        raise Exception(f"Error while decoding legacy image data:\n{str(error)}") from error
+
+
 def image_to_json(image: MatLike) -> str:
 
     try:
@@ -131,9 +288,10 @@ def image_to_json(image: MatLike) -> str:
         if height == 0 or width == 0:
             raise ValueError("Invalid image dimensions.")
 
-        compressed_image = compress_binary_string(image.tostring().hex()) #type: ignore
+        if len(image.shape) != 2:
+            raise ValueError("Invalid input: 'image' must be a single channel image.")
 
-        return json.dumps({"image": compressed_image, "height": height, "width": width})
+        return json.dumps({"image": encode_runs(image), "height": height, "width": width})
 
     except Exception as error:
         raise Exception(f"Error while converting image to JSON:\n{str(error)}") from error
@@ -150,7 +308,13 @@ def json_to_image(json_string: str) -> MatLike:
         if "image" not in load or "height" not in load or "width" not in load:
             raise ValueError("Invalid JSON format for image data.")
 
-        return np.array(np.array(decompress_binary_string(load["image"]), dtype=np.uint8), dtype=np.uint8).reshape((load["height"], load["width"]))
+        if isinstance(load["image"], str):
+            return decode_legacy_runs(load["image"], load["height"], load["width"])
+
+        if load["image"].get("encoding") != RUN_LENGTH_ENCODING:
+            raise ValueError(f"Unsupported image encoding: {load['image'].get('encoding')}")
+
+        return decode_runs(load["image"], load["height"], load["width"])
     except Exception as error:
         raise Exception(f"Error while processing JSON data:\n{str(error)}") from error
 
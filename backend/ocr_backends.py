@@ -0,0 +1,126 @@
+#ocr_backends.py
+import logging
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+import numpy as np
+from cv2.typing import MatLike
+import pytesseract # type: ignore
+
+from ocr_words import TSV_COLUMNS, parse_tsv
+
+try:
+    import tesserocr # type: ignore
+except ImportError:
+    tesserocr = None
+
+logger = logging.getLogger(__name__)
+
+PYTESSERACT = "pytesseract"
+TESSEROCR = "tesserocr"
+OCR_BACKENDS = (PYTESSERACT, TESSEROCR)
+# Fully automatic page segmentation, the default of the tesseract command
+DEFAULT_PSM = 3
+
+_backend = PYTESSERACT
+# Idle engines per language, lent to whichever thread OCRs next
+_engines: dict[str, queue.SimpleQueue] = {}
+_engines_lock = threading.Lock()
+
+
+def configure(backend: str) -> str:
+    """
+    Selects the OCR backend of this process, falling back to pytesseract when tesserocr is not installed.
+
+    Returns:
+        str: The backend in use.
+    """
+    global _backend
+
+    if backend not in OCR_BACKENDS:
+        raise ValueError(f"Unknown OCR backend: {backend}, expected one of {', '.join(OCR_BACKENDS)}")
+
+    if backend == TESSEROCR and tesserocr is None:
+        logger.warning("tesserocr is not installed, OCR falls back to pytesseract")
+        backend = PYTESSERACT
+
+    _backend = backend
+    return _backend
+
+
+def current_backend() -> str:
+
+    return _backend
+
+
+def available_languages() -> list[str]:
+
+    if tesserocr is not None:
+        return tesserocr.get_languages()[1]
+    return pytesseract.get_languages()
+
+
+@contextmanager
+def checkout_engine(language: str):
+    """
+    Lends an idle Tesseract engine for a language, loading its traineddata only when every engine is busy.
+
+    An engine is not thread-safe, so each one serves one thread at a time, but it outlives the thread:
+    short lived band and variant threads reuse the engines of those before them, and a process only
+    ever loads as many engines as it runs OCR threads at once.
+    """
+    with _engines_lock:
+        idle = _engines.setdefault(language, queue.SimpleQueue())
+
+    try:
+        engine = idle.get_nowait()
+    except queue.Empty:
+        engine = tesserocr.PyTessBaseAPI(lang=language)
+        logger.info(f"Loaded Tesseract engine for {language}")
+
+    try:
+        yield engine
+    finally:
+        engine.Clear()
+        idle.put(engine)
+
+
+def load_image(engine, image: MatLike, psm: Optional[int] = None) -> None:
+
+    # The pixels go to the loaded engine in memory, pytesseract would write a PNG and start a tesseract process instead.
+    pixels = np.ascontiguousarray(image)
+    height, width = pixels.shape[:2]
+    bytes_per_pixel = 1 if pixels.ndim == 2 else pixels.shape[2]
+
+    engine.SetPageSegMode(DEFAULT_PSM if psm is None else psm)
+    engine.SetImageBytes(pixels.tobytes(), width, height, bytes_per_pixel, pixels.strides[0])
+
+
+def engine_image_to_string(image: MatLike, language: str, psm: Optional[int] = None) -> str:
+
+    with checkout_engine(language) as engine:
+        load_image(engine, image, psm)
+        return engine.GetUTF8Text()
+
+
+def image_to_string(image: MatLike, language: str, psm: Optional[int] = None) -> str:
+
+    if _backend == TESSEROCR:
+        return engine_image_to_string(image, language, psm)
+    return pytesseract.image_to_string(image, lang=language, config="" if psm is None else f"--psm {psm}")
+
+
+def image_to_data(image: MatLike, language: str, psm: Optional[int] = None) -> dict[str, np.ndarray]:
+    """
+    Reads the words of an image with their boxes, line ids and confidences, see ocr_words.parse_tsv().
+    """
+    if _backend == TESSEROCR:
+        with checkout_engine(language) as engine:
+            load_image(engine, image, psm)
+            tsv = engine.GetTSVText(0)
+        # The engine leaves out the header row the tesseract command writes.
+        return parse_tsv("\t".join(TSV_COLUMNS) + "\n" + tsv)
+
+    return parse_tsv(pytesseract.image_to_data(image, lang=language, config="" if psm is None else f"--psm {psm}"))
@@ -0,0 +1,143 @@
+#ocr_words.py
+import io
+
+import numpy as np
+
+# Columns of Tesseract's TSV output kept for every word, the page and level columns are dropped
+WORD_COLUMNS = {
+    "block_num": np.uint16,
+    "par_num": np.uint16,
+    "line_num": np.uint16,
+    "word_num": np.uint16,
+    "left": np.int32,
+    "top": np.int32,
+    "width": np.int32,
+    "height": np.int32,
+    "conf": np.float32,
+}
+TSV_COLUMNS = ("level", "page_num", "block_num", "par_num", "line_num", "word_num",
+               "left", "top", "width", "height", "conf", "text")
+# Level of word rows in the TSV, lower levels are pages, blocks, paragraphs and lines
+TSV_WORD_LEVEL = "5"
+WORDS_FORMAT_VERSION = 1
+
+
+def empty_words() -> dict[str, np.ndarray]:
+
+    words = {column: np.empty(0, dtype) for column, dtype in WORD_COLUMNS.items()}
+    words["text"] = np.empty(0, np.str_)
+    return words
+
+
+def parse_tsv(tsv: str) -> dict[str, np.ndarray]:
+    """
+    Turns the TSV of tesseract or pytesseract.image_to_data into columns of the words it read.
+
+    Rows of pages, blocks, paragraphs and lines and words without text or confidence are dropped.
+
+    Returns:
+        dict[str, np.ndarray]: One array per WORD_COLUMNS entry plus "text", all as long as the word count.
+    """
+    try:
+        rows = []
+        for row in tsv.splitlines()[1:]:
+            fields = row.split("\t", len(TSV_COLUMNS) - 1)
+            if len(fields) != len(TSV_COLUMNS) or fields[0] != TSV_WORD_LEVEL or not fields[-1].strip():
+                continue
+            if float(fields[10]) < 0:
+                continue
+            rows.append(fields)
+
+        if not rows:
+            return empty_words()
+
+        columns = list(zip(*rows))
+        words = {column: np.array(columns[TSV_COLUMNS.index(column)], dtype=np.float64).astype(dtype)
+                 for column, dtype in WORD_COLUMNS.items()}
+        words["text"] = np.array(columns[-1], dtype=np.str_)
+        return words
+
+    except Exception as error:
+        raise Exception(f"Error while parsing Tesseract TSV:\nError: {str(error)}") from error
+
+
+def words_to_text(words: dict[str, np.ndarray]) -> str:
+    """
+    Rebuilds the text of the words as Tesseract lays it out: one line per line it found and an empty
+    line between paragraphs.
+    """
+    lines: list[str] = []
+    previous_line = previous_paragraph = None
+    for text, block, paragraph, line in zip(words["text"], words["block_num"], words["par_num"], words["line_num"]):
+        if (block, paragraph, line) == previous_line:
+            lines[-1] += " " + str(text)
+            continue
+        if previous_paragraph is not None and (block, paragraph) != previous_paragraph:
+            lines.append("")
+        lines.append(str(text))
+        previous_line, previous_paragraph = (block, paragraph, line), (block, paragraph)
+
+    return "\n".join(lines)
+
+
+def mean_confidence(words: dict[str, np.ndarray]) -> float:
+
+    # Tesseract rates every word from 0 to 100, no words means nothing was read at all.
+    return float(words["conf"].mean()) if words["conf"].size else 0.0
+
+
+def shift_words(words: dict[str, np.ndarray], left: int = 0, top: int = 0) -> dict[str, np.ndarray]:
+
+    # Boxes of a cropped image move back into the coordinates of the image it was cropped from.
+    if not left and not top:
+        return words
+    return {**words, "left": words["left"] + left, "top": words["top"] + top}
+
+
+def stack_lines(parts: list[dict[str, np.ndarray]], tops: list[int]) -> dict[str, np.ndarray]:
+    """
+    Joins the words of image strips read one by one, e.g. text bands, into the words of the whole image.
+
+    Strips are stacked top to bottom at the given rows and their lines numbered on in one paragraph,
+    so words_to_text() gives one line per line without empty lines between strips.
+    """
+    stacked = []
+    next_line = 1
+    for words, top in zip(parts, tops):
+        if not words["text"].size:
+            continue
+        key = (words["block_num"].astype(np.int64) << 32) | (words["par_num"].astype(np.int64) << 16) | words["line_num"]
+        line = np.concatenate(([0], np.cumsum(key[1:] != key[:-1]))) + next_line
+        next_line = int(line[-1]) + 1
+        ones = np.ones(line.size, WORD_COLUMNS["block_num"])
+        stacked.append({**shift_words(words, 0, top), "block_num": ones, "par_num": ones,
+                        "line_num": line.astype(WORD_COLUMNS["line_num"])})
+
+    if not stacked:
+        return empty_words()
+    return {column: np.concatenate([words[column] for words in stacked]) for column in stacked[0]}
+
+
+def encode_words(words: dict[str, np.ndarray]) -> bytes:
+    """
+    Packs the word columns into a compressed .npz, a few kilobytes for a whole receipt.
+    """
+    try:
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, version=np.array(WORDS_FORMAT_VERSION), **words)
+        return buffer.getvalue()
+
+    except Exception as error:
+        raise Exception(f"Error while encoding OCR words:\nError: {str(error)}") from error
+
+
+def decode_words(data: bytes) -> dict[str, np.ndarray]:
+
+    try:
+        with np.load(io.BytesIO(data), allow_pickle=False) as archive:
+            if int(archive["version"]) != WORDS_FORMAT_VERSION:
+                raise ValueError(f"Unsupported OCR words version: {int(archive['version'])}")
+            return {column: archive[column] for column in (*WORD_COLUMNS, "text")}
+
+    except Exception as error:
+        raise Exception(f"Error while decoding OCR words:\nError: {str(error)}") from error
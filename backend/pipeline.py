@@ -0,0 +1,146 @@
+#pipeline.py
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from cv2.typing import MatLike
+from typing import Optional
+
+from preprocessing import BINARIZE_VARIANTS, binarize, crop_receipt, crop_to_text, deskew, preprocess, pyramid_width
+from imagemaneger import bands_to_words, image_to_text, image_to_words
+from ocr_words import encode_words, mean_confidence, shift_words, words_to_text
+from ocr_backends import PYTESSERACT, TESSEROCR, checkout_engine, configure
+from profiling import in_context, profiled_stage, stage
+
+_variant_executor = None
+_variant_executor_lock = threading.Lock()
+
+
+def warm_up(ocr_backend: str = PYTESSERACT, languages: tuple[str, ...] = ('pol',)) -> None:
+
+    # Every pool worker owns one core, so keep OpenCV and Tesseract from spawning threads of their own.
+    cv2.setNumThreads(1)
+    os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+    # Load the traineddata while the worker starts rather than on its first receipt.
+    if configure(ocr_backend) == TESSEROCR:
+        for language in languages:
+            with checkout_engine(language):
+                pass
+
+
+@profiled_stage
+def read_image(image_path: str) -> MatLike:
+
+    image = cv2.imread(image_path)
+    if image is None:
+        raise ValueError("Failed to read image")
+
+    return image
+
+
+@profiled_stage
+def decode_image(buffer) -> MatLike:
+
+    # np.frombuffer wraps bytes, a memoryview or an mmap without copying, imdecode reads it in place.
+    image = cv2.imdecode(np.frombuffer(buffer, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Failed to decode image")
+
+    return image
+
+
+def read_words(processed_image: MatLike, language: str = 'pol', band_workers: int = 0,
+               text_crop: bool = False) -> dict[str, np.ndarray]:
+    """
+    OCRs a processed receipt, whole or band by band, into the columns of ocr_words.
+    """
+    # Words read from the text crop are shifted back into the coordinates of processed_image.
+    ocr_image, left, top = processed_image, 0, 0
+    if text_crop:
+        with stage("crop_to_text") as details:
+            ocr_image, details["eliminated_fraction"], (left, top) = crop_to_text(processed_image)
+
+    if band_workers:
+        words = bands_to_words(ocr_image, language, band_workers)
+    else:
+        words = image_to_words(ocr_image, language)
+    return shift_words(words, left, top)
+
+
+def get_variant_executor() -> ThreadPoolExecutor:
+    global _variant_executor
+    with _variant_executor_lock:
+        if _variant_executor is None:
+            _variant_executor = ThreadPoolExecutor(max_workers=len(BINARIZE_VARIANTS), thread_name_prefix="ocr-variant")
+        return _variant_executor
+
+
+def read_variants(image: MatLike, language: str, working_width: Optional[int], variants: tuple[str, ...],
+                  band_workers: int = 0, text_crop: bool = False) -> tuple[MatLike, dict[str, np.ndarray]]:
+    """
+    Binarizes a receipt photo with every variant, OCRs each and keeps the one whose words have the best mean confidence.
+    """
+    working_width = pyramid_width(image, working_width)
+    cropped_image = crop_receipt(image, working_width)
+
+    # Variants run in threads the receipts of the process share, OpenCV and Tesseract release the GIL.
+    # Bands of all variants go to the one band executor, so at most its workers OCR at once.
+    def read_variant(variant: str) -> tuple[MatLike, dict[str, np.ndarray]]:
+        with stage(variant):
+            processed_image = deskew(binarize(cropped_image, variant), working_width)
+            return processed_image, read_words(processed_image, language, band_workers, text_crop)
+
+    with stage("read_variants") as details:
+        try:
+            results = list(get_variant_executor().map(in_context(read_variant), variants))
+
+        except Exception as error:
+            raise Exception(f"Error while reading binarization variants:\nError: {str(error)}") from error
+
+        # Ties go to the variant listed first.
+        confidences = [mean_confidence(words) for _, words in results]
+        best = max(range(len(variants)), key=lambda index: confidences[index])
+        details["variant"] = variants[best]
+        details["confidences"] = dict(zip(variants, confidences))
+
+    return results[best]
+
+
+def process_image(image: MatLike, language: str = 'pol', working_width: Optional[int] = None,
+                  band_workers: int = 0, text_crop: bool = False,
+                  variants: tuple[str, ...] = ()) -> tuple[bytes, str, bytes]:
+    """
+    Preprocesses and OCRs a receipt photo into its PNG, its text and its words packed by ocr_words.encode_words().
+    """
+    if variants:
+        processed_image, words = read_variants(image, language, working_width, variants, band_workers, text_crop)
+    else:
+        processed_image = preprocess(image, working_width)
+        words = read_words(processed_image, language, band_workers, text_crop)
+
+    with stage("encode_png"):
+        success, encoded_image = cv2.imencode('.png', processed_image)
+    if not success:
+        raise ValueError("Failed to encode the processed image")
+
+    return encoded_image.tobytes(), words_to_text(words), encode_words(words)
+
+
+def process_image_file(image_path: str, language: str = 'pol', working_width: Optional[int] = None,
+                       band_workers: int = 0, text_crop: bool = False, variants: tuple[str, ...] = ()) -> tuple[bytes, str, bytes]:
+
+    return process_image(read_image(image_path), language, working_width, band_workers, text_crop, variants)
+
+
+def process_image_buffer(buffer, language: str = 'pol', working_width: Optional[int] = None,
+                         band_workers: int = 0, text_crop: bool = False, variants: tuple[str, ...] = ()) -> tuple[bytes, str, bytes]:
+
+    return process_image(decode_image(buffer), language, working_width, band_workers, text_crop, variants)
+
+
+def image_file_to_text(image_path: str, language: str = 'pol') -> str:
+
+    return image_to_text(read_image(image_path), language)
@@ -0,0 +1,147 @@
+#profiling.py
+import contextvars
+import functools
+import resource
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+
+_active_profile: contextvars.ContextVar[Optional["Profile"]] = contextvars.ContextVar("active_profile", default=None)
+# Stages open around the code running in this context, innermost last
+_open_stages: contextvars.ContextVar[tuple[dict, ...]] = contextvars.ContextVar("open_stages", default=())
+
+
+def _children_cpu_time() -> float:
+
+    # Tesseract runs as a child process, its CPU time is only visible here once pytesseract has waited for it.
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Profile:
+    """
+    Wall time, CPU time and, when trace_memory is set, peak traced memory of every stage run while active.
+
+    Nested stages are recorded under dotted names, e.g. "correct_skew.estimate_skew", and are included
+    in the numbers of the stage around them. stage() yields a dict whose items are added to the record,
+    for measurements of the stage's own such as the share of pixels it cropped.
+
+    CPU time is that of the stage's thread plus the threads it handed work to through in_context(),
+    under which that work nests. Child processes such as pytesseract's tesseract are only counted
+    process wide, so their CPU time is recorded apart, as children_cpu_seconds of the outermost stages.
+    Tracemalloc keeps one peak per process too, so peak memory, what the stage allocated above the
+    memory in use when it started, is only recorded for stages of the thread that created the profile
+    and includes the threads they handed work to. Profiles active at the same time in one process,
+    as with inline processing in request threads, still see each other's children and allocations.
+    """
+
+    def __init__(self, trace_memory: bool = False):
+
+        self.trace_memory = trace_memory
+        self.stages: list[dict] = []
+        self._lock = threading.Lock()
+        self._thread = threading.get_ident()
+
+    @contextmanager
+    def stage(self, name: str):
+
+        open_stages = _open_stages.get()
+        parent = open_stages[-1] if open_stages else None
+        frame = {"name": ".".join([*(open_stage["name"] for open_stage in open_stages[-1:]), name]),
+                 "thread": threading.get_ident(), "thread_cpu": 0.0}
+        trace_memory = self.trace_memory and frame["thread"] == self._thread
+        if trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            frame.update(start_memory=current, peak_before=peak, inner_peak=0)
+            tracemalloc.reset_peak()
+        token = _open_stages.set((*open_stages, frame))
+
+        details: dict = {}
+        start_wall, start_cpu = time.perf_counter(), time.thread_time()
+        start_children = _children_cpu_time() if parent is None else 0.0
+        try:
+            yield details
+        finally:
+            wall = time.perf_counter() - start_wall
+            thread_cpu = time.thread_time() - start_cpu
+            _open_stages.reset(token)
+
+            with self._lock:
+                # CPU time of other threads reaches this stage through the stages they ran for it.
+                thread_cpu += frame["thread_cpu"]
+                if parent is not None:
+                    parent["thread_cpu"] += thread_cpu if parent["thread"] != frame["thread"] else frame["thread_cpu"]
+
+                record = {"stage": frame["name"], "wall_seconds": wall, "cpu_seconds": thread_cpu}
+                if parent is None:
+                    record["children_cpu_seconds"] = _children_cpu_time() - start_children
+                if trace_memory:
+                    # Nested stages reset the peak as well, so each one hands what it saw to the stage around it.
+                    stage_peak = max(tracemalloc.get_traced_memory()[1], frame["inner_peak"])
+                    record["peak_bytes"] = max(stage_peak - frame["start_memory"], 0)
+                    if parent is not None and "inner_peak" in parent:
+                        parent["inner_peak"] = max(parent["inner_peak"], frame["peak_before"], stage_peak)
+                record.update(details)
+                self.stages.append(record)
+
+
+@contextmanager
+def stage(name: str):
+
+    profile = _active_profile.get()
+    if profile is None:
+        yield {}
+        return
+
+    with profile.stage(name) as details:
+        yield details
+
+
+def profiled_stage(func: Callable) -> Callable:
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with stage(func.__name__):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def in_context(func: Callable) -> Callable:
+
+    # Threads start in an empty context, so work handed to one runs in a copy of the caller's, with the
+    # active profile and the stages open around it. A context is entered by one thread at a time, hence a copy per call.
+    context = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return context.copy().run(func, *args, **kwargs)
+
+    return wrapper
+
+
+def call_profiled(trace_memory: bool, func: Callable, *args) -> tuple[object, list[dict]]:
+    """
+    Runs func with profiling active, from a pool worker or inline.
+
+    Returns:
+        tuple: The result of func and the recorded stages, in the order they finished.
+    """
+    profile = Profile(trace_memory)
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+
+    token, open_token = _active_profile.set(profile), _open_stages.set(())
+    try:
+        result = func(*args)
+    finally:
+        _open_stages.reset(open_token)
+        _active_profile.reset(token)
+        if started_tracing:
+            tracemalloc.stop()
+
+    return result, profile.stages
@@ -6,7 +6,7 @@ from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.forms import ReadOnlyPasswordHashField
 from django.core.exceptions import ValidationError
 
-from receiptreader.models import Product, Receipt, User
+from receiptreader.models import ProcessingJob, Product, Receipt, User
 
 
 class UserCreationForm(forms.ModelForm):
@@ -75,4 +75,5 @@ class UserAdmin(BaseUserAdmin):
 admin.site.register(User, UserAdmin)
 admin.site.register(Product)
 admin.site.register(Receipt)
+admin.site.register(ProcessingJob)
 admin.site.unregister(Group)
\ No newline at end of file
@@ -6,4 +6,9 @@ class ReceiptreaderConfig(AppConfig):
     name = 'receiptreader'
 
     def ready(self):
-        import receiptreader.signals
\ No newline at end of file
+        import receiptreader.signals
+        from django.conf import settings
+        from ocr_backends import configure
+
+        # Inline processing runs in this process, pool workers configure themselves in warm_up().
+        configure(settings.OCR_BACKEND)
\ No newline at end of file
@@ -0,0 +1,150 @@
+# receiptreader/derivatives.py
+import bisect
+import os
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+from . import metrics
+from .disk_cache import RunningSize, evict_least_recently_used, touch, write_atomic
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVES_DIR = 'derivatives'
+FORMATS = {
+    'webp': ('.webp', cv2.IMWRITE_WEBP_QUALITY),
+    'jpeg': ('.jpg', cv2.IMWRITE_JPEG_QUALITY),
+}
+# JPEG decoding can downscale by these factors in the DCT, far cheaper than decoding the full photo.
+REDUCED_READ_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+_cached_bytes = RunningSize()
+
+derivative_hits = metrics.counter('receipt_derivative_cache_hits_total', 'Resized receipt images served from the disk cache.')
+derivative_misses = metrics.counter('receipt_derivative_cache_misses_total', 'Resized receipt images rendered on demand.')
+derivative_evictions = metrics.counter('receipt_derivative_cache_evictions_total', 'Resized receipt images evicted from the disk cache.')
+
+
+def snap_width(width):
+    """
+    Rounds a requested width up to the nearest of RECEIPT_DERIVATIVE_WIDTHS so clients cannot fill
+    the cache with one entry per pixel.
+    """
+    widths = sorted(settings.RECEIPT_DERIVATIVE_WIDTHS)
+    return widths[min(bisect.bisect_left(widths, width), len(widths) - 1)]
+
+
+def derivative_name(image_name, width, image_format):
+    directory, filename = os.path.split(image_name)
+    stem = os.path.splitext(filename)[0]
+    return f"{directory}/{DERIVATIVES_DIR}/{stem}-{width}{FORMATS[image_format][0]}"
+
+
+def read_reduced(path, source_width, width):
+    # Without a known source width, e.g. when Pillow cannot read the header, the photo is decoded in full.
+    for factor, flag in REDUCED_READ_FLAGS:
+        if source_width and source_width // factor >= width:
+            image = cv2.imread(path, flag)
+            if image is not None:
+                return image
+    return cv2.imread(path, cv2.IMREAD_COLOR)
+
+
+def render(path, source_width, width, image_format):
+    image = read_reduced(path, source_width, width)
+    if image is None:
+        raise ValueError(f"Could not decode {path}")
+
+    height, current_width = image.shape[:2]
+    if current_width > width:
+        image = cv2.resize(image, (width, max(1, round(height * width / current_width))), interpolation=cv2.INTER_AREA)
+
+    extension, quality_flag = FORMATS[image_format]
+    success, encoded = cv2.imencode(extension, image, [quality_flag, settings.RECEIPT_DERIVATIVE_QUALITY])
+    if not success:
+        raise ValueError(f"Could not encode {path} as {image_format}")
+    return np.asarray(encoded).tobytes()
+
+
+def get_derivative(image_field, width, image_format):
+    """
+    Returns the storage name of image_field scaled down to a cached width and format, rendering it on a miss.
+
+    Derivatives live next to the receipt images in receipts/<unique_id>/derivatives/. A derivative
+    older than its source image is rendered again, so replacing a receipt photo needs no cleanup.
+
+    Raises:
+        FileNotFoundError: When the source image is missing from storage.
+        ValueError: When the source image cannot be decoded or the derivative encoded.
+    """
+    name = derivative_name(image_field.name, width, image_format)
+    path = default_storage.path(name)
+    source_path = image_field.path
+    source_mtime = os.stat(source_path).st_mtime
+    try:
+        stat = os.stat(path)
+        fresh, stale_bytes = stat.st_mtime >= source_mtime, stat.st_size
+    except FileNotFoundError:
+        fresh, stale_bytes = False, 0
+
+    if fresh:
+        touch(path)
+        derivative_hits.inc()
+        return name
+
+    derivative_misses.inc()
+    source_width = image_field.width
+    try:
+        data = render(source_path, source_width, width, image_format)
+    except Exception as error:
+        raise ValueError(f"Error rendering derivative {name}:\nError: {str(error)}") from error
+    write_atomic(path, data)
+    logger.debug(f"Rendered derivative {name} ({len(data)} bytes)")
+    track_size(len(data) - stale_bytes, keep=path)
+    return name
+
+
+def track_size(added, keep=None):
+    """
+    Adds to the running size of the derivatives, scanning them for eviction only once it exceeds
+    RECEIPT_DERIVATIVE_CACHE_MAX_BYTES or is not known yet.
+    """
+    _cached_bytes.add(default_storage.path('receipts'), added, settings.RECEIPT_DERIVATIVE_CACHE_MAX_BYTES,
+                      lambda: evict(keep))
+
+
+def evict(keep=None):
+    """
+    Keeps derivatives within RECEIPT_DERIVATIVE_CACHE_MAX_BYTES, never removing keep, the one just rendered.
+
+    Returns:
+        int: Total size in bytes of the derivatives kept.
+    """
+    receipts_dir = default_storage.path('receipts')
+    entries = []
+    with os.scandir(receipts_dir) as receipt_dirs:
+        for receipt_dir in receipt_dirs:
+            directory = os.path.join(receipt_dir.path, DERIVATIVES_DIR)
+            if os.path.isdir(directory):
+                entries.extend([os.path.join(directory, name)] for name in os.listdir(directory)
+                               if not name.endswith('.tmp'))
+
+    max_bytes = settings.RECEIPT_DERIVATIVE_CACHE_MAX_BYTES
+    keep_bytes = 0
+    if keep is not None:
+        entries = [paths for paths in entries if paths[0] != keep]
+        keep_bytes = os.path.getsize(keep)
+        max_bytes = max(max_bytes - keep_bytes, 0)
+    removed, total = evict_least_recently_used(entries, max_bytes)
+    if removed:
+        derivative_evictions.inc(len(removed))
+        logger.info(f"Evicted {len(removed)} receipt image derivatives")
+    return total + keep_bytes
@@ -0,0 +1,93 @@
+# receiptreader/disk_cache.py
+import os
+import tempfile
+import threading
+
+
+def touch(path):
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+
+
+def write_atomic(path, data):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as temp_file:
+            temp_file.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def evict_least_recently_used(entries, max_bytes):
+    """
+    Removes the least recently used cache entries until their total size fits in max_bytes.
+    Every entry is a list of files removed together, e.g. an image and its text.
+    Cache hits touch their files, so the modification time works as the last access time.
+
+    Returns:
+        tuple: The removed entries and the total size in bytes of the entries kept.
+    """
+    stats = []
+    for paths in entries:
+        sizes, mtimes = [], []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            sizes.append(stat.st_size)
+            mtimes.append(stat.st_mtime)
+        if sizes:
+            stats.append((max(mtimes), sum(sizes), list(paths)))
+
+    total = sum(size for _, size, _ in stats)
+    removed = []
+    for _, size, paths in sorted(stats, key=lambda entry: entry[0]):
+        if total <= max_bytes:
+            break
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        total -= size
+        removed.append(paths)
+
+    return removed, total
+
+
+class RunningSize:
+    """
+    Running size of disk caches per directory, so storing an entry only scans a cache for eviction
+    when the size is not known yet or exceeds its budget.
+
+    The size is counted from disk by the first eviction pass of the process and after every eviction,
+    entries other processes store are seen at the next pass.
+    """
+
+    def __init__(self):
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    def add(self, directory, added, max_bytes, evict):
+        # evict() removes what does not fit and returns the size in bytes of what is left.
+        with self._lock:
+            total = self._totals.get(directory)
+            if total is not None and total + added <= max_bytes:
+                self._totals[directory] = total + added
+                return
+            self._totals[directory] = evict()
+
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
@@ -0,0 +1,153 @@
+# receiptreader/downloads.py
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+SENDFILE_HEADERS = {
+    'x-accel-redirect': 'X-Accel-Redirect',
+    'x-sendfile': 'X-Sendfile',
+}
+
+
+class UnsatisfiableRange(ValueError):
+    pass
+
+
+class FileRange:
+    """
+    File-like view of length bytes of an open file starting at offset, streamed by FileResponse.
+    """
+    def __init__(self, file, offset, length):
+        file.seek(offset)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def file_etag(stat):
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def parse_range(header, size):
+    """
+    Reads a single byte range from a Range header.
+
+    Returns:
+        tuple: Inclusive (start, end) of the range, None when the whole file should be sent because
+            the header is missing, malformed or asks for several ranges.
+
+    Raises:
+        UnsatisfiableRange: When the range starts past the end of the file.
+    """
+    match = RANGE_PATTERN.match(header.strip()) if header else None
+    if match is None:
+        return None
+
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        suffix = int(last)
+        if suffix == 0 or size == 0:
+            raise UnsatisfiableRange(f"Empty suffix range of a {size} byte file")
+        return max(size - suffix, 0), size - 1
+
+    start = int(first)
+    if start >= size:
+        raise UnsatisfiableRange(f"Range starts at {start} of a {size} byte file")
+    end = min(int(last), size - 1) if last else size - 1
+    if end < start:
+        return None
+    return start, end
+
+
+def if_range_matches(request, etag, last_modified):
+    """
+    A Range header only applies while If-Range, when sent, still names the current file.
+    """
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def serve_file(request, name, filename):
+    """
+    Streams the file stored under name with conditional GET and single byte range support.
+
+    With RECEIPT_IMAGE_SENDFILE set only the headers are built here and the front proxy sends the
+    bytes, including ranges.
+
+    Raises:
+        OSError: When the file is missing from storage.
+    """
+    path = default_storage.path(name)
+    stat = os.stat(path)
+    etag = file_etag(stat)
+    last_modified = int(stat.st_mtime)
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        sendfile = settings.RECEIPT_IMAGE_SENDFILE
+        if sendfile:
+            response = HttpResponse(content_type=content_type)
+            if sendfile == 'x-accel-redirect':
+                response[SENDFILE_HEADERS[sendfile]] = settings.RECEIPT_IMAGE_ACCEL_PREFIX.rstrip('/') + '/' + quote(name)
+            else:
+                response[SENDFILE_HEADERS[sendfile]] = path
+        else:
+            response = _file_response(request, path, stat.st_size, content_type, etag, last_modified)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Accept-Ranges'] = 'bytes'
+    response['Cache-Control'] = 'private'
+    if response.status_code != 304:
+        response['Content-Disposition'] = f'inline; filename="{filename}"'
+    return response
+
+
+def _file_response(request, path, size, content_type, etag, last_modified):
+    byte_range = None
+    if if_range_matches(request, etag, last_modified):
+        try:
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+        except UnsatisfiableRange as error:
+            logger.warning(f"Unsatisfiable range for {path}: {error}")
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    if byte_range is None:
+        return FileResponse(open(path, 'rb'), content_type=content_type)
+
+    start, end = byte_range
+    length = end - start + 1
+    response = FileResponse(FileRange(open(path, 'rb'), start, length), status=206, content_type=content_type)
+    response['Content-Length'] = length
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
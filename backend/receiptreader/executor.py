@@ -0,0 +1,112 @@
+# receiptreader/executor.py
+import atexit
+import multiprocessing
+import threading
+import weakref
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+from pipeline import warm_up
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = threading.Lock()
+# Pool each submitted task runs in, so a task that overruns its timeout can take its pool down
+_task_pools = weakref.WeakKeyDictionary()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.RECEIPT_POOL_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=warm_up,
+                initargs=(settings.OCR_BACKEND,)
+            )
+            logger.info(f"Started image pipeline pool with {settings.RECEIPT_POOL_WORKERS} workers")
+        return _pool
+
+
+def shutdown_pool(wait=True):
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=wait, cancel_futures=True)
+            _pool = None
+
+
+atexit.register(shutdown_pool, wait=False)
+
+
+def submit(func, *args):
+    if not settings.RECEIPT_POOL_WORKERS:
+        return _run_inline(func, *args)
+
+    pool = get_pool()
+    try:
+        future = pool.submit(func, *args)
+    except BrokenProcessPool:
+        logger.error("Image pipeline pool broke, it will be restarted on the next task", exc_info=True)
+        _discard_pool(pool)
+        raise
+
+    _task_pools[future] = pool
+    future.add_done_callback(lambda done: _discard_if_broken(pool, done))
+    return future
+
+
+def wait_for(future, name, timeout=None):
+    if timeout is None:
+        timeout = settings.RECEIPT_POOL_TASK_TIMEOUT
+
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        if not future.cancel():
+            # A running task cannot be cancelled, a hung Tesseract would hold its worker for good, so the pool
+            # is terminated and the next task starts a new one. Tasks running next to it fail and are retried.
+            logger.error(f"{name} is still running after {timeout}s, terminating the image pipeline pool")
+            pool = _task_pools.get(future)
+            if pool is not None:
+                _discard_pool(pool, terminate=True)
+        raise TimeoutError(f"{name} did not finish within {timeout} seconds")
+
+
+def _run_inline(func, *args):
+    future = Future()
+    try:
+        future.set_result(func(*args))
+    except Exception as error:
+        future.set_exception(error)
+    return future
+
+
+def _discard_if_broken(pool, future):
+    global _pool
+    if future.cancelled() or not isinstance(future.exception(), BrokenProcessPool):
+        return
+
+    # Runs on the pool's own management thread, which is already tearing the broken pool down.
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+            logger.error("Image pipeline pool broke, it will be restarted on the next task")
+
+
+def _discard_pool(pool, terminate=False):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    if terminate:
+        # ProcessPoolExecutor has no public way to stop a running task before Python 3.14.
+        for process in list(pool._processes.values()):
+            process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
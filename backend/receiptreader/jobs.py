@@ -0,0 +1,133 @@
+# receiptreader/jobs.py
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import metrics
+from .models import ProcessingJob
+from .services import store_processed_receipt
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = (ProcessingJob.STATUS_PENDING, ProcessingJob.STATUS_RUNNING)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def queue_depth():
+    return ProcessingJob.objects.filter(status__in=ACTIVE_STATUSES).count()
+
+
+jobs_completed = metrics.counter('receipt_jobs_completed_total', 'Receipt processing jobs finished successfully.')
+jobs_retried = metrics.counter('receipt_jobs_retried_total', 'Receipt processing attempts scheduled for a retry.')
+jobs_failed = metrics.counter('receipt_jobs_failed_total', 'Receipt processing jobs that exhausted their attempts.')
+metrics.gauge('receipt_jobs_queue_depth', 'Receipt processing jobs pending or running.', callback=queue_depth)
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.RECEIPT_PROCESSING_WORKERS,
+                thread_name_prefix='receipt-job'
+            )
+        return _executor
+
+
+def enqueue_receipt(receipt, prepared=None):
+    return enqueue_receipts([receipt], [prepared])[0]
+
+
+def enqueue_receipts(receipts, prepared=None):
+    if prepared is None:
+        prepared = [None] * len(receipts)
+
+    jobs = ProcessingJob.objects.bulk_create([ProcessingJob(receipt=receipt) for receipt in receipts])
+    for job in jobs:
+        logger.info(f"Queued job {job.pk} for receipt {job.receipt_id}")
+
+    if settings.RECEIPT_PROCESSING_ASYNC:
+        for job, prepared_image in zip(jobs, prepared):
+            transaction.on_commit(lambda job_id=job.pk, prepared_image=prepared_image: submit_job(job_id, prepared=prepared_image))
+    else:
+        for job, prepared_image in zip(jobs, prepared):
+            run_job(job.pk, prepared=prepared_image)
+            job.refresh_from_db()
+    return jobs
+
+
+def submit_job(job_id, delay=0, prepared=None):
+    if delay:
+        timer = threading.Timer(delay, submit_job, args=(job_id,))
+        timer.daemon = True
+        timer.start()
+        return
+
+    get_executor().submit(_run_job_in_worker, job_id, prepared)
+
+
+def _run_job_in_worker(job_id, prepared=None):
+    close_old_connections()
+    try:
+        run_job(job_id, prepared=prepared)
+    except Exception as e:
+        logger.error(f"Unexpected error in job {job_id}: {str(e)}", exc_info=True)
+    finally:
+        close_old_connections()
+
+
+def run_job(job_id, asynchronous=None, prepared=None):
+    if asynchronous is None:
+        asynchronous = settings.RECEIPT_PROCESSING_ASYNC
+
+    claimed = ProcessingJob.objects.filter(pk=job_id, status=ProcessingJob.STATUS_PENDING).update(
+        status=ProcessingJob.STATUS_RUNNING,
+        attempts=F('attempts') + 1,
+        updated_at=timezone.now()
+    )
+    if not claimed:
+        logger.warning(f"Job {job_id} is not pending, skipping")
+        return
+
+    try:
+        job = ProcessingJob.objects.select_related('receipt').get(pk=job_id)
+    except ProcessingJob.DoesNotExist:
+        logger.warning(f"Job {job_id} was removed before it could run")
+        return
+
+    try:
+        # Retries start over from the stored original, the prepared result only serves the first attempt.
+        store_processed_receipt(job.receipt, prepared)
+    except Exception as e:
+        logger.error(f"Job {job.pk} attempt {job.attempts} failed: {str(e)}", exc_info=True)
+        job.error = str(e)
+
+        if job.attempts < settings.RECEIPT_PROCESSING_MAX_ATTEMPTS:
+            job.status = ProcessingJob.STATUS_PENDING
+            job.save(update_fields=['status', 'error', 'updated_at'])
+            jobs_retried.inc()
+
+            if asynchronous:
+                submit_job(job.pk, delay=settings.RECEIPT_PROCESSING_RETRY_DELAY * job.attempts)
+            else:
+                run_job(job.pk, asynchronous=False)
+            return
+
+        job.status = ProcessingJob.STATUS_FAILED
+        job.save(update_fields=['status', 'error', 'updated_at'])
+        jobs_failed.inc()
+        return
+
+    job.status = ProcessingJob.STATUS_DONE
+    job.error = ''
+    job.save(update_fields=['status', 'error', 'updated_at'])
+    jobs_completed.inc()
+    logger.info(f"Job {job.pk} finished for receipt {job.receipt_id}")
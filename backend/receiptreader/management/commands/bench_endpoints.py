@@ -0,0 +1,131 @@
+# receiptreader/management/commands/bench_endpoints.py
+import logging
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from receiptreader.models import ProcessingJob, Product, Receipt, User
+from receiptreader.summary import recompute_summary
+
+CATEGORIES = ["Food", "Drink", "Dairy", "Bakery", "Household", "Electronics", "Clothes", "Pharmacy"]
+PASSWORD = "bench-password"
+INDEXED_MODELS = (Receipt, Product, ProcessingJob)
+
+
+def percentile(timings, fraction):
+    ordered = sorted(timings)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class Command(BaseCommand):
+    help = ("Seeds a throwaway test database with N users x M receipts and reports p50/p99 latency of the "
+            "hot endpoints with the secondary indexes, then again after dropping them.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--receipts', type=int, default=200, help="Receipts per user.")
+        parser.add_argument('--products', type=int, default=10, help="Products per receipt.")
+        parser.add_argument('--requests', type=int, default=200, help="Requests per endpoint and index state.")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        logging.disable(logging.INFO)
+        try:
+            # A fast hasher keeps the login numbers about the email lookup rather than PBKDF2.
+            with override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher']):
+                rng = random.Random(options['seed'])
+                start = time.perf_counter()
+                users = self.seed(rng, options['users'], options['receipts'], options['products'])
+                self.stdout.write(f"Seeded {options['users']} users x {options['receipts']} receipts x "
+                                  f"{options['products']} products on {connection.vendor} in {time.perf_counter() - start:.1f}s")
+
+                indexed = self.measure(rng, users, options['requests'])
+                self.drop_indexes()
+                plain = self.measure(rng, users, options['requests'])
+
+            self.stdout.write(f"{'endpoint':>24} {'p50 idx':>9} {'p99 idx':>9} {'p50 none':>9} {'p99 none':>9}")
+            for name, timings in indexed.items():
+                self.stdout.write(f"{name:>24} " + " ".join(
+                    f"{value * 1000:>9.2f}" for value in (
+                        percentile(timings, 0.5), percentile(timings, 0.99),
+                        percentile(plain[name], 0.5), percentile(plain[name], 0.99)
+                    )
+                ))
+        finally:
+            logging.disable(logging.NOTSET)
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def seed(self, rng, user_count, receipt_count, product_count):
+        password = make_password(PASSWORD)
+        User.objects.bulk_create([
+            User(email=f"bench{index}@example.com", username=f"bench{index}", password=password)
+            for index in range(user_count)
+        ])
+        User.objects.bulk_create([User(email="bench-admin@example.com", username="admin", password=password, is_admin=True)])
+        users = list(User.objects.filter(is_admin=False))
+
+        now = timezone.now()
+        for user in users:
+            receipts = Receipt.objects.bulk_create([
+                Receipt(user=user, title=f"Receipt {index}", date_of_shopping=now - timedelta(hours=rng.randint(0, 24 * 365)))
+                for index in range(receipt_count)
+            ])
+            Product.objects.bulk_create([
+                Product(name=f"Product {index}", price=Decimal(rng.randint(1, 50000)) / 100,
+                        category=rng.choice(CATEGORIES), receipt=receipt, user=user)
+                for receipt in receipts for index in range(product_count)
+            ])
+            ProcessingJob.objects.bulk_create([
+                ProcessingJob(receipt=receipt, status=ProcessingJob.STATUS_DONE, attempts=1) for receipt in receipts
+            ])
+            recompute_summary(user.pk)
+        return users
+
+    def endpoints(self, rng, user):
+        return {
+            'receipts page': ('get', reverse('receipt-list'), {'page_size': 20}),
+            'receipts page light': ('get', reverse('receipt-list'), {'page_size': 20, 'include_products': 'false'}),
+            'products by category': ('get', reverse('products-by-category', args=[rng.choice(CATEGORIES)]), {'page_size': 50}),
+            'user summary': ('get', reverse('user-summary'), {}),
+            'login': ('post', reverse('login'), {'email': user.email, 'password': PASSWORD}),
+            'metrics': ('get', reverse('metrics'), {}),
+        }
+
+    def measure(self, rng, users, requests):
+        client = APIClient()
+        admin = User.objects.get(is_admin=True)
+        timings = {}
+        for request_index in range(requests + 5):
+            user = users[request_index % len(users)]
+            for name, (method, url, data) in self.endpoints(rng, user).items():
+                client.force_authenticate(user=admin if name == 'metrics' else user)
+                # Keep DRF's per-user throttles out of the measurement.
+                cache.clear()
+                start = time.perf_counter()
+                response = getattr(client, method)(url, data)
+                elapsed = time.perf_counter() - start
+                if response.status_code >= 400:
+                    raise AssertionError(f"{name} returned {response.status_code}")
+                # The first requests only warm up caches and connections.
+                if request_index >= 5:
+                    timings.setdefault(name, []).append(elapsed)
+        return timings
+
+    def drop_indexes(self):
+        with connection.schema_editor() as schema_editor:
+            for model in INDEXED_MODELS:
+                for index in model._meta.indexes:
+                    schema_editor.remove_index(model, index)
@@ -0,0 +1,73 @@
+# receiptreader/management/commands/bench_save_products.py
+import statistics
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from receiptreader.models import Product, Receipt, User
+from receiptreader.services import save_products
+from receiptreader.utils import parse_receipt_text
+
+
+def receipt_text(lines, edited=False):
+    text = [f"Product {index} &&{index % 500 + 1}.{index % 100:02d}&& ##Category {index % 7}##" for index in range(lines)]
+    if edited:
+        text[lines // 2] = "Edited product &&9.99&& ##Edited##"
+    return "\n".join(text)
+
+
+def legacy_save_products(instance):
+    instance.products.all().delete()
+    for product_data in parse_receipt_text(instance.text):
+        Product.objects.create(
+            name=product_data['name'],
+            price=product_data['price'],
+            category=product_data['category'],
+            receipt=instance,
+            user=instance.user
+        )
+
+
+class Command(BaseCommand):
+    help = ("Times save_products() against the original create-per-line implementation on the configured database. "
+            "Point DJANGO_SETTINGS_MODULE at settings using PostgreSQL to compare backends.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', nargs='+', type=int, default=[10, 100, 1000], help="Receipt sizes to measure.")
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--skip-legacy', action='store_true', help="Only measure the bulk implementation.")
+
+    def handle(self, *args, **options):
+        implementations = [('bulk', save_products)]
+        if not options['skip_legacy']:
+            implementations.append(('legacy', legacy_save_products))
+
+        name = f"bench-{uuid.uuid4().hex[:12]}"
+        user = User.objects.create_user(email=f"{name}@example.com", username=name, password=uuid.uuid4().hex)
+        try:
+            self.stdout.write(f"Database: {connection.vendor}")
+            self.stdout.write(f"{'lines':>6} {'impl':>7} {'fresh ms':>9} {'re-edit ms':>11} {'unchanged ms':>13}")
+            for lines in options['lines']:
+                for label, implementation in implementations:
+                    timings = self.measure(user, implementation, lines, options['repeat'])
+                    self.stdout.write(f"{lines:>6} {label:>7} " + " ".join(
+                        f"{statistics.median(timings[key]) * 1000:>{width}.1f}"
+                        for key, width in (('fresh', 9), ('edited', 11), ('unchanged', 13))
+                    ))
+        finally:
+            user.delete()
+
+    def measure(self, user, implementation, lines, repeat):
+        timings = {'fresh': [], 'edited': [], 'unchanged': []}
+        for _ in range(repeat):
+            receipt = Receipt.objects.create(user=user, text=receipt_text(lines))
+            for key, text in (('fresh', receipt.text), ('edited', receipt_text(lines, edited=True)),
+                              ('unchanged', receipt_text(lines, edited=True))):
+                receipt.text = text
+                start = time.perf_counter()
+                implementation(receipt)
+                timings[key].append(time.perf_counter() - start)
+            receipt.delete()
+        return timings
@@ -0,0 +1,33 @@
+# receiptreader/management/commands/process_receipt_jobs.py
+from django.core.management.base import BaseCommand
+
+from receiptreader.jobs import run_job
+from receiptreader.models import ProcessingJob
+
+
+class Command(BaseCommand):
+    help = "Runs receipt processing jobs left pending, e.g. after a server restart."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requeue-running',
+            action='store_true',
+            help="Reset jobs stuck in the running state back to pending before processing.",
+        )
+
+    def handle(self, *args, **options):
+        if options['requeue_running']:
+            requeued = ProcessingJob.objects.filter(status=ProcessingJob.STATUS_RUNNING).update(
+                status=ProcessingJob.STATUS_PENDING
+            )
+            self.stdout.write(f"Requeued {requeued} running jobs")
+
+        job_ids = list(
+            ProcessingJob.objects.filter(status=ProcessingJob.STATUS_PENDING)
+            .order_by('created_at')
+            .values_list('pk', flat=True)
+        )
+        for job_id in job_ids:
+            run_job(job_id, asynchronous=False)
+
+        self.stdout.write(self.style.SUCCESS(f"Processed {len(job_ids)} pending jobs"))
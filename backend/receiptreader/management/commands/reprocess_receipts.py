@@ -0,0 +1,138 @@
+# receiptreader/management/commands/reprocess_receipts.py
+import datetime
+import itertools
+import json
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from receiptreader.disk_cache import write_atomic
+from receiptreader.models import Receipt
+from receiptreader.services import prepare_receipt, save_products, store_processed_receipt
+from receiptreader.summary import deferred_summary
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHECKPOINT = settings.BASE_DIR / 'cache' / 'reprocess_receipts.json'
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+class Command(BaseCommand):
+    help = ("Runs preprocessing, OCR and product parsing again for stored receipts, e.g. after the preprocessing "
+            "parameters changed. Receipts are read in chunks whose images are processed in the receipt pool "
+            "together, progress is checkpointed after every chunk and an interrupted run resumes from there.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', default=[], help="Email or id of a user, can be repeated.")
+        parser.add_argument('--since', type=datetime.date.fromisoformat, help="First shopping date, YYYY-MM-DD.")
+        parser.add_argument('--until', type=datetime.date.fromisoformat, help="Last shopping date, YYYY-MM-DD.")
+        parser.add_argument('--chunk-size', type=int, default=50,
+                            help="Receipts processed in the pool at once and between checkpoints.")
+        parser.add_argument('--checkpoint', default=str(DEFAULT_CHECKPOINT), help="Progress file of the run.")
+        parser.add_argument('--restart', action='store_true', help="Ignore the checkpoint and start from the first receipt.")
+        parser.add_argument('--use-cache', action='store_true',
+                            help="Take results from the OCR cache. Off by default, since its key does not cover every "
+                                 "change to the pipeline the run is meant to pick up.")
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be at least 1")
+
+        filters = {
+            'users': sorted(options['user']),
+            'since': options['since'].isoformat() if options['since'] else None,
+            'until': options['until'].isoformat() if options['until'] else None,
+        }
+        checkpoint_path = options['checkpoint']
+        checkpoint = {'filters': filters, 'last_pk': 0, 'processed': 0, 'failed': []}
+        if not options['restart'] and os.path.exists(checkpoint_path):
+            with open(checkpoint_path, encoding='utf-8') as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+            if checkpoint['filters'] != filters:
+                raise CommandError(f"{checkpoint_path} belongs to a run with other filters {checkpoint['filters']}, "
+                                   f"pass the same filters to resume it or --restart to start over")
+            self.stdout.write(f"Resuming after receipt {checkpoint['last_pk']}, {checkpoint['processed']} already processed")
+
+        receipts = self.receipts(filters).filter(pk__gt=checkpoint['last_pk']).order_by('pk')
+        total = receipts.count()
+        self.stdout.write(f"{total} receipts to reprocess")
+
+        done = 0
+        start = time.perf_counter()
+        receipt_iterator = receipts.iterator(chunk_size=options['chunk_size'])
+        while chunk := list(itertools.islice(receipt_iterator, options['chunk_size'])):
+            failed = self.process_chunk(chunk, options['use_cache'])
+
+            checkpoint['last_pk'] = chunk[-1].pk
+            checkpoint['processed'] += len(chunk) - len(failed)
+            checkpoint['failed'] += failed
+            write_atomic(checkpoint_path, json.dumps(checkpoint).encode('utf-8'))
+
+            done += len(chunk)
+            elapsed = time.perf_counter() - start
+            rate = done / elapsed if elapsed else 0.0
+            eta = (total - done) / rate if rate else 0.0
+            self.stdout.write(f"{done}/{total} receipts, {rate:.2f} receipts/s, ETA {format_duration(eta)}, "
+                              f"{len(checkpoint['failed'])} failed")
+
+        # A finished run leaves nothing to resume, the next one starts from the first receipt again.
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        message = f"Reprocessed {checkpoint['processed']} receipts in {format_duration(time.perf_counter() - start)}"
+        if checkpoint['failed']:
+            self.stdout.write(self.style.WARNING(f"{message}, failed: {', '.join(map(str, checkpoint['failed']))}"))
+        else:
+            self.stdout.write(self.style.SUCCESS(message))
+
+    def receipts(self, filters):
+        receipts = Receipt.objects.exclude(original_image='').exclude(original_image__isnull=True)
+        if filters['users']:
+            user_filter = Q(user__email__in=filters['users'])
+            user_ids = [user for user in filters['users'] if user.isdigit()]
+            if user_ids:
+                user_filter |= Q(user_id__in=user_ids)
+            receipts = receipts.filter(user_filter)
+        if filters['since']:
+            receipts = receipts.filter(date_of_shopping__date__gte=filters['since'])
+        if filters['until']:
+            receipts = receipts.filter(date_of_shopping__date__lte=filters['until'])
+        return receipts
+
+    def process_chunk(self, chunk, use_cache=False):
+        """
+        Processes a chunk of receipts and returns the ids of those that failed.
+
+        Every image of the chunk is submitted to the pool before the first result is collected,
+        so the chunk is spread over all pool workers. Summaries are recomputed once per user and chunk.
+        """
+        prepared = {}
+        failed = []
+        for receipt in chunk:
+            try:
+                prepared[receipt.pk] = prepare_receipt(receipt, use_cache)
+            except Exception as e:
+                logger.error(f"Could not start reprocessing receipt {receipt.pk}: {str(e)}")
+                failed.append(receipt.pk)
+
+        with deferred_summary(*{receipt.user_id for receipt in chunk}):
+            for receipt in chunk:
+                if receipt.pk not in prepared:
+                    continue
+                try:
+                    store_processed_receipt(receipt, prepared[receipt.pk])
+                    save_products(receipt)
+                except Exception as e:
+                    logger.error(f"Reprocessing receipt {receipt.pk} failed: {str(e)}")
+                    failed.append(receipt.pk)
+
+        return failed
@@ -0,0 +1,126 @@
+# receiptreader/metrics.py
+import threading
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+    return '{' + pairs + '}'
+
+
+class Metric:
+    metric_type = 'untyped'
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+
+    def samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(labels)} {value}")
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    metric_type = 'counter'
+
+    def __init__(self, name, documentation):
+        super().__init__(name, documentation)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [('', dict(key), value) for key, value in items] or [('', {}, 0)]
+
+
+class Gauge(Metric):
+    metric_type = 'gauge'
+
+    def __init__(self, name, documentation, callback=None):
+        super().__init__(name, documentation)
+        self._value = 0
+        self._callback = callback
+
+    def set(self, value):
+        with self._lock:
+            self._value = value
+
+    def value(self):
+        return self._callback() if self._callback else self._value
+
+    def samples(self):
+        return [('', {}, self.value())]
+
+
+class Histogram(Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, buckets):
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, count, total = self._values.get(key, ([0] * len(self.buckets), 0, 0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self._values[key] = (counts, count + 1, total + value)
+
+    def count(self, **labels):
+        return self._values.get(tuple(sorted(labels.items())), (None, 0, 0))[1]
+
+    def samples(self):
+        with self._lock:
+            items = [(dict(key), list(counts), count, total) for key, (counts, count, total) in self._values.items()]
+        samples = []
+        for labels, counts, count, total in items:
+            for bound, bucket_count in zip(self.buckets, counts):
+                samples.append(('_bucket', {**labels, 'le': bound}, bucket_count))
+            samples.append(('_bucket', {**labels, 'le': '+Inf'}, count))
+            samples.append(('_sum', labels, total))
+            samples.append(('_count', labels, count))
+        return samples
+
+
+def register(metric):
+    with _registry_lock:
+        return _registry.setdefault(metric.name, metric)
+
+
+def counter(name, documentation):
+    return register(Counter(name, documentation))
+
+
+def gauge(name, documentation, callback=None):
+    return register(Gauge(name, documentation, callback))
+
+
+def histogram(name, documentation, buckets):
+    return register(Histogram(name, documentation, buckets))
+
+
+def render_metrics():
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return '\n'.join(metric.render() for metric in metrics) + '\n'
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receiptreader', '0005_processingjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usersummary',
+            name='category_count',
+            field=models.JSONField(default=dict),
+        ),
+    ]
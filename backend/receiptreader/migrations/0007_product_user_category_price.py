@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receiptreader', '0006_usersummary_category_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['user', 'category', 'price'], name='product_user_category_price'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receiptreader', '0007_product_user_category_price'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='processingjob',
+            index=models.Index(fields=['status', 'created_at'], name='job_status_created'),
+        ),
+        migrations.AddIndex(
+            model_name='receipt',
+            index=models.Index(fields=['user', 'date_of_shopping', 'id'], name='receipt_user_date'),
+        ),
+    ]
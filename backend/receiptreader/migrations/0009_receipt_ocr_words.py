@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:03
+
+import receiptreader.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receiptreader', '0008_receipt_and_job_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='receipt',
+            name='ocr_words',
+            field=models.FileField(blank=True, null=True, upload_to=receiptreader.models.receipt_upload_path),
+        ),
+    ]
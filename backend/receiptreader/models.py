@@ -74,11 +74,19 @@ class Receipt(models.Model):
     text = models.TextField(null=True, blank=True, default='')
     original_image = models.ImageField(upload_to=receipt_upload_path, null=True, blank=True)
     processed_image = models.ImageField(upload_to=receipt_upload_path, null=True, blank=True)
+    # Words of the OCR with boxes, line ids and confidences (ocr_words.encode_words), re-parsed without Tesseract
+    ocr_words = models.FileField(upload_to=receipt_upload_path, null=True, blank=True)
     address = models.TextField(null=True, blank=True)
     date_of_shopping = models.DateTimeField(default=timezone.now)
     total = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Receipt listings filter on user and page newest first on (date_of_shopping, id).
+            models.Index(fields=['user', 'date_of_shopping', 'id'], name='receipt_user_date'),
+        ]
+
     def __str__(self):
         return self.title
 
@@ -91,6 +99,12 @@ class Product(models.Model):
     receipt = models.ForeignKey('Receipt', on_delete=models.CASCADE, related_name='products')
     user = models.ForeignKey('User', on_delete=models.CASCADE, related_name='products')
 
+    class Meta:
+        indexes = [
+            # Serves ProductsByCategoryView, which filters on user and category and orders by price.
+            models.Index(fields=['user', 'category', 'price'], name='product_user_category_price'),
+        ]
+
     def __str__(self):
         return self.name if self.name else "Unnamed Product"
 
@@ -100,3 +114,34 @@ class UserSummary(models.Model):
     total_spent = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
     category_avg = models.JSONField(default=dict)
     category_summary = models.JSONField(default=dict)
+    # [products, products with a price] per category, kept so the summary can be updated incrementally
+    category_count = models.JSONField(default=dict)
+
+
+class ProcessingJob(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    receipt = models.ForeignKey(Receipt, on_delete=models.CASCADE, related_name='jobs')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Queue depth counts active jobs and process_receipt_jobs drains pending ones oldest first.
+            models.Index(fields=['status', 'created_at'], name='job_status_created'),
+        ]
+
+    def __str__(self):
+        return f"Job {self.pk} ({self.status}) for receipt {self.receipt_id}"
@@ -0,0 +1,119 @@
+# receiptreader/ocr_cache.py
+import hashlib
+import json
+import os
+from collections import defaultdict
+
+from django.conf import settings
+
+from imagemaneger import band_parameters
+from preprocessing import preprocessing_parameters
+from . import metrics
+from .disk_cache import RunningSize, evict_least_recently_used, file_size, touch, write_atomic
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Bump when the pipeline code changes its output in a way the parameters of make_key() do not show
+CACHE_VERSION = 2
+IMAGE_SUFFIX = '.png'
+TEXT_SUFFIX = '.txt'
+WORDS_SUFFIX = '.npz'
+READ_CHUNK_SIZE = 1024 * 1024
+
+_cached_bytes = RunningSize()
+
+cache_hits = metrics.counter('receipt_ocr_cache_hits_total', 'OCR results served from the content-hash cache.')
+cache_misses = metrics.counter('receipt_ocr_cache_misses_total', 'OCR lookups that missed the content-hash cache.')
+cache_evictions = metrics.counter('receipt_ocr_cache_evictions_total', 'Entries evicted from the content-hash cache.')
+
+
+def is_enabled():
+    return settings.OCR_CACHE_MAX_BYTES > 0
+
+
+def make_key(image, language, preprocess=True, **options):
+    # An upload still in memory hashes to the same key as the file it is later saved to.
+    digest = hashlib.sha256()
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        digest.update(image)
+    else:
+        with open(image, 'rb') as image_file:
+            for chunk in iter(lambda: image_file.read(READ_CHUNK_SIZE), b''):
+                digest.update(chunk)
+
+    parameters = {'version': CACHE_VERSION, 'language': language, 'preprocess': preprocess,
+                  'ocr_backend': settings.OCR_BACKEND}
+    if preprocess:
+        parameters.update(preprocessing_parameters())
+        parameters.update(band_parameters())
+    parameters.update(options)
+    digest.update(json.dumps(parameters, sort_keys=True).encode('utf-8'))
+
+    return digest.hexdigest()
+
+
+def _entry_path(key, suffix):
+    return os.path.join(settings.OCR_CACHE_DIR, key + suffix)
+
+
+def get(key, with_image=True):
+    """
+    Returns (image, text, words) of a cached entry, image and words None for entries stored without them.
+
+    Entries of a processed receipt need all three, so one written before the words were cached is a miss.
+    """
+    if not is_enabled():
+        return None
+
+    paths = [_entry_path(key, TEXT_SUFFIX)]
+    if with_image:
+        paths += [_entry_path(key, IMAGE_SUFFIX), _entry_path(key, WORDS_SUFFIX)]
+
+    try:
+        contents = []
+        for path in paths:
+            with open(path, 'rb') as cached_file:
+                contents.append(cached_file.read())
+    except FileNotFoundError:
+        cache_misses.inc()
+        return None
+
+    for path in paths:
+        touch(path)
+    cache_hits.inc()
+    logger.debug(f"OCR cache hit for {key}")
+
+    image, words = contents[1:] if with_image else (None, None)
+    return image, contents[0].decode('utf-8'), words
+
+
+def put(key, text, image=None, words=None):
+    if not is_enabled():
+        return
+
+    added = 0
+    for suffix, data in ((IMAGE_SUFFIX, image), (WORDS_SUFFIX, words), (TEXT_SUFFIX, text.encode('utf-8'))):
+        if data is None:
+            continue
+        path = _entry_path(key, suffix)
+        # A result stored again, e.g. by reprocess_receipts, replaces the entry it had.
+        added += len(data) - file_size(path)
+        write_atomic(path, data)
+    _cached_bytes.add(str(settings.OCR_CACHE_DIR), added, settings.OCR_CACHE_MAX_BYTES, evict)
+
+
+def evict():
+    directory = settings.OCR_CACHE_DIR
+    entries = defaultdict(list)
+    for name in os.listdir(directory):
+        stem, suffix = os.path.splitext(name)
+        if suffix in (IMAGE_SUFFIX, TEXT_SUFFIX, WORDS_SUFFIX):
+            entries[stem].append(os.path.join(directory, name))
+
+    removed, total = evict_least_recently_used(entries.values(), settings.OCR_CACHE_MAX_BYTES)
+    if removed:
+        cache_evictions.inc(len(removed))
+        logger.info(f"Evicted {len(removed)} entries from the OCR cache")
+    return total
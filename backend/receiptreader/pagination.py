@@ -0,0 +1,120 @@
+# receiptreader/pagination.py
+import base64
+import binascii
+import json
+from datetime import datetime
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Descending keyset pagination over (ordering_field, id), newest receipts first by default.
+
+    Every page is a single range query continuing after the last row of the previous one,
+    so deep pages cost the same as the first. Lists stay unpaginated unless the client sends
+    cursor or page_size, which keeps the existing app working. Rows without a value in
+    ordering_field come last.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    ordering_field = 'date_of_shopping'
+    invalid_cursor_message = 'Invalid cursor'
+
+    @staticmethod
+    def parse_value(value):
+        return datetime.fromisoformat(value)
+
+    def is_requested(self, request):
+        return self.cursor_query_param in request.query_params or self.page_size_query_param in request.query_params
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, settings.RECEIPT_PAGE_SIZE))
+        except ValueError:
+            page_size = settings.RECEIPT_PAGE_SIZE
+        return min(max(page_size, 1), settings.RECEIPT_MAX_PAGE_SIZE)
+
+    def get_position(self, row):
+        if isinstance(row, dict):
+            return row[self.ordering_field], row['id']
+        return getattr(row, self.ordering_field), row.pk
+
+    def encode_cursor(self, row):
+        value, pk = self.get_position(row)
+        if value is not None:
+            value = value.isoformat() if isinstance(value, datetime) else str(value)
+        position = json.dumps([value, pk])
+        return base64.urlsafe_b64encode(position.encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, cursor):
+        try:
+            value, pk = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+            return (None if value is None else self.parse_value(value)), int(pk)
+        except (binascii.Error, UnicodeError, ValueError, TypeError, ArithmeticError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def order_queryset(self, queryset):
+        return queryset.order_by(F(self.ordering_field).desc(nulls_last=True), '-id')
+
+    def filter_after(self, queryset, value, pk):
+        field = self.ordering_field
+        if value is None:
+            return queryset.filter(Q(**{f'{field}__isnull': True, 'id__lt': pk}))
+        return queryset.filter(Q(**{f'{field}__lt': value}) | Q(**{field: value, 'id__lt': pk})
+                               | Q(**{f'{field}__isnull': True}))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.is_requested(request):
+            return None
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        queryset = self.order_queryset(queryset)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = self.filter_after(queryset, *self.decode_cursor(cursor))
+
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.page_size_query_param, self.page_size)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class PriceKeysetPagination(KeysetPagination):
+    """Most expensive products first."""
+    ordering_field = 'price'
+
+    @staticmethod
+    def parse_value(value):
+        return Decimal(value)
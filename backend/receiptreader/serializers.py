@@ -1,7 +1,7 @@
 #receiptreader/serializers.py
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
-from .models import Receipt, Product
+from .models import ProcessingJob, Receipt, Product
 from django.urls import reverse
 
 User = get_user_model()
@@ -56,6 +56,20 @@ class ReceiptSerializer(serializers.ModelSerializer):
 
         return rep
 
+class ReceiptListSerializer(ReceiptSerializer):
+    """ReceiptSerializer without the nested products, for listing long receipt histories."""
+
+    class Meta(ReceiptSerializer.Meta):
+        fields = [field for field in ReceiptSerializer.Meta.fields if field != 'products']
+
+
+class ProcessingJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ProcessingJob
+        fields = ['id', 'receipt', 'status', 'attempts', 'error', 'created_at', 'updated_at']
+        read_only_fields = fields
+
+
 class UpdateReceiptSerializer(serializers.ModelSerializer):
     class Meta:
         model = Receipt
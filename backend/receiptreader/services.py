@@ -1,33 +1,164 @@
 # receiptreader/services.py
+import io
+import json
+import mmap
 import os
+from collections import namedtuple
+from contextlib import contextmanager
+from django.conf import settings
 from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
+from django.db import transaction
 from rest_framework.exceptions import ValidationError
-import cv2
+from . import metrics, ocr_cache
+from .executor import submit, wait_for
 from .utils import parse_receipt_text
-from .models import Product
-from preprocessing import preprocess
-from imagemaneger import image_to_text
+from .models import Product, Receipt
+from .summary import deferred_summary, to_cents
+from ocr_words import decode_words, words_to_text
+from pipeline import image_file_to_text, process_image_buffer, process_image_file
+from profiling import call_profiled
 import logging
 
 logger = logging.getLogger(__name__)
 
 
-def process_receipt_image(instance):
-    image_path = instance.original_image.path
-    image_np = cv2.imread(image_path)
-    if image_np is None:
-        raise ValidationError("Failed to read image")
+PreparedImage = namedtuple('PreparedImage', ['cache_key', 'cached', 'future'])
 
-    processed_image_np = preprocess(image_np)
-    success, encoded_image = cv2.imencode('.png', processed_image_np)
-    if not success:
-        raise ValidationError("Failed to encode the processed image")
+STAGE_SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+STAGE_BYTES_BUCKETS = tuple(2 ** power * 1024 * 1024 for power in range(0, 12))
+ELIMINATED_RATIO_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.8)
+OCR_WORDS_FILENAME = 'ocr_words.npz'
+REPARSE_BATCH_SIZE = 200
 
-    processed_image_text = image_to_text(processed_image_np, 'pol')
-    processed_image_file = ContentFile(encoded_image.tobytes())
+stage_wall_seconds = metrics.histogram('receipt_stage_wall_seconds', 'Wall time of receipt processing stages.', STAGE_SECONDS_BUCKETS)
+stage_cpu_seconds = metrics.histogram('receipt_stage_cpu_seconds', 'CPU time of the threads of receipt processing stages.', STAGE_SECONDS_BUCKETS)
+stage_children_cpu_seconds = metrics.histogram('receipt_stage_children_cpu_seconds', 'CPU time of child processes, e.g. Tesseract, of outermost receipt processing stages.', STAGE_SECONDS_BUCKETS)
+stage_peak_bytes = metrics.histogram('receipt_stage_peak_bytes', 'Peak traced memory of receipt processing stages.', STAGE_BYTES_BUCKETS)
+ocr_variant_selected = metrics.counter('receipt_ocr_variant_selected_total', 'Binarization variants chosen by OCR confidence.')
+ocr_eliminated_ratio = metrics.histogram('receipt_ocr_pixels_eliminated_ratio', 'Share of processed image pixels cropped away before OCR.', ELIMINATED_RATIO_BUCKETS)
+
+
+@contextmanager
+def upload_buffer(upload):
+    # A read-only view of the upload, without copying it out of Django's memory or temporary file buffer.
+    if hasattr(upload, 'temporary_file_path'):
+        with open(upload.temporary_file_path(), 'rb') as upload_file:
+            if os.fstat(upload_file.fileno()).st_size == 0:
+                yield memoryview(b'')
+                return
+            with mmap.mmap(upload_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+                yield view
+    elif isinstance(getattr(upload, 'file', None), io.BytesIO):
+        with upload.file.getbuffer() as view:
+            yield view
+    else:
+        upload.seek(0)
+        yield upload.read()
+
+
+def _prepare(image, process, use_cache=True):
+    working_width = settings.RECEIPT_PREPROCESS_WORKING_WIDTH
+    band_workers = settings.OCR_BAND_WORKERS
+    text_crop = settings.OCR_CROP_TO_TEXT
+    # Band OCR and text cropping read different text, whole-image keys stay as they were.
+    options = {'ocr_bands': True} if band_workers else {}
+    if text_crop:
+        options['ocr_text_crop'] = True
+    variants = tuple(settings.OCR_BINARIZE_VARIANTS)
+    if variants:
+        options['ocr_variants'] = list(variants)
+    cache_key = ocr_cache.make_key(image, 'pol', working_width=working_width, **options)
+
+    # Skipping the lookup still stores the new result, so it replaces whatever the cache held for the image.
+    cached = ocr_cache.get(cache_key) if use_cache else None
+    if cached:
+        return PreparedImage(cache_key, cached, None)
+
+    future = submit(call_profiled, settings.RECEIPT_PROFILE_MEMORY, process, image, 'pol', working_width, band_workers, text_crop, variants)
+    return PreparedImage(cache_key, None, future)
+
+
+def record_stages(stages, subject):
+    """
+    Feeds the stages measured by profiling.call_profiled into the stage histograms and logs them as one JSON line.
+    """
+    for record in stages:
+        stage_wall_seconds.observe(record['wall_seconds'], stage=record['stage'])
+        stage_cpu_seconds.observe(record['cpu_seconds'], stage=record['stage'])
+        if 'children_cpu_seconds' in record:
+            stage_children_cpu_seconds.observe(record['children_cpu_seconds'], stage=record['stage'])
+        if 'peak_bytes' in record:
+            stage_peak_bytes.observe(record['peak_bytes'], stage=record['stage'])
+        if 'eliminated_fraction' in record:
+            ocr_eliminated_ratio.observe(record['eliminated_fraction'])
+        if 'variant' in record:
+            ocr_variant_selected.inc(variant=record['variant'])
+
+    logger.info(f"Stages of {subject}: {json.dumps(stages)}")
+
+
+def prepare_receipt_upload(upload):
+    try:
+        with upload_buffer(upload) as buffer:
+            # Pool workers receive their own pickled copy, inline processing decodes the view in place.
+            image = bytes(buffer) if settings.RECEIPT_POOL_WORKERS else buffer
+            prepared = _prepare(image, process_image_buffer)
+    except Exception as e:
+        logger.warning(f"Could not process upload {upload.name} from memory, it will be read from storage: {str(e)}")
+        return None
+
+    logger.debug(f"Started processing upload {upload.name} before it is stored")
+    return prepared
+
+
+def prepare_receipt(instance, use_cache=True):
+    """
+    Starts preprocessing and OCR of a stored receipt image in the pool, process_receipt_image() collects the result.
+    """
+    try:
+        return _prepare(instance.original_image.path, process_image_file, use_cache)
+    except OSError as error:
+        raise ValidationError("Failed to read image") from error
+
+
+def process_receipt_image(instance, prepared=None):
+    if prepared is None:
+        prepared = prepare_receipt(instance)
+
+    if prepared.cached:
+        encoded_image, processed_image_text, words = prepared.cached
+    else:
+        try:
+            (encoded_image, processed_image_text, words), stages = wait_for(prepared.future, f"Processing receipt {instance.pk}")
+        except ValueError as error:
+            raise ValidationError(str(error)) from error
+        record_stages(stages, f"receipt {instance.pk}")
+        ocr_cache.put(prepared.cache_key, processed_image_text, encoded_image, words)
+
+    # ContentFile wraps the encoded bytes in a BytesIO, which shares the buffer instead of copying it.
+    processed_image_file = ContentFile(encoded_image)
+
+    return processed_image_file, processed_image_text, ContentFile(words)
+
+
+def store_processed_receipt(instance, prepared=None):
+    processed_image_file, instance.text, words_file = process_receipt_image(instance, prepared)
+
+    # Replaced only once processing succeeded, so a failed attempt leaves the previous result in place.
+    if instance.processed_image:
+        instance.processed_image.delete(save=False)
+    if instance.ocr_words:
+        instance.ocr_words.delete(save=False)
+    instance.ocr_words.save(OCR_WORDS_FILENAME, words_file, save=False)
+
+    original_filename = instance.original_image.name.split('/')[-1]
+    processed_filename = 'processed_' + original_filename
+    instance.processed_image.save(processed_filename, processed_image_file)
+    save_receipt_text(instance)
+    instance.save()
+    logger.info(f"Processed image saved for receipt {instance.pk}")
 
-    return processed_image_file, processed_image_text
 
 def save_receipt_text(instance):
     directory = os.path.dirname(instance.original_image.path)
@@ -37,31 +168,98 @@ def save_receipt_text(instance):
 
 
 def extract_text_from_image(image_path):
-    image_np = cv2.imread(image_path)
-    if image_np is None:
-        raise Exception("Failed to read image")
+    cache_key = ocr_cache.make_key(image_path, 'pol', preprocess=False)
+    cached = ocr_cache.get(cache_key, with_image=False)
+    if cached:
+        return cached[1]
 
-    text_image = image_to_text(image_np, 'pol')
+    future = submit(call_profiled, settings.RECEIPT_PROFILE_MEMORY, image_file_to_text, image_path, 'pol')
+    text_image, stages = wait_for(future, image_file_to_text.__name__)
+    record_stages(stages, image_path)
+    ocr_cache.put(cache_key, text_image)
     return text_image
 
 
+PRODUCT_FIELDS = ('name', 'price', 'category')
+
+
+def _product_changed(product, product_data):
+    return (product.name != product_data['name'] or product.category != product_data['category']
+            or product.price != to_cents(product_data['price']))
+
+
 def save_products(instance):
     try:
         products_data = parse_receipt_text(instance.text)
         if not products_data:
             logger.warning(f"No products found in receipt text: {instance.text}")
 
-        instance.products.all().delete()
-
-        for product_data in products_data:
-            Product.objects.create(
-                name=product_data['name'],
-                price=product_data['price'],
-                category=product_data['category'],
-                receipt=instance,
-                user=instance.user
-            )
-        logger.info(f"Products saved successfully for receipt {instance.pk}")
+        # Lines are matched by position, so a re-edited receipt only writes the lines that changed
+        # and the summary is recomputed once for the whole receipt.
+        with transaction.atomic(), deferred_summary(instance.user_id):
+            existing = list(instance.products.order_by('id'))
+
+            changed = []
+            for product, product_data in zip(existing, products_data):
+                if _product_changed(product, product_data):
+                    for field in PRODUCT_FIELDS:
+                        setattr(product, field, product_data[field])
+                    changed.append(product)
+            Product.objects.bulk_update(changed, PRODUCT_FIELDS)
+
+            created = Product.objects.bulk_create([
+                Product(
+                    name=product_data['name'],
+                    price=product_data['price'],
+                    category=product_data['category'],
+                    receipt=instance,
+                    user=instance.user
+                )
+                for product_data in products_data[len(existing):]
+            ])
+
+            removed = [product.pk for product in existing[len(products_data):]]
+            if removed:
+                Product.objects.filter(pk__in=removed).delete()
+
+        logger.info(f"Products saved successfully for receipt {instance.pk}: {len(created)} created, "
+                    f"{len(changed)} updated, {len(removed)} removed")
     except Exception as e:
         logger.error(f"Error saving products for receipt {instance.pk}: {str(e)}", exc_info=True)
-        raise ValidationError("Error saving products.")
\ No newline at end of file
+        raise ValidationError("Error saving products.")
+
+
+def reparse_receipts(receipts):
+    """
+    Rebuilds the text and products of receipts from their stored OCR words, without running Tesseract.
+
+    Receipts without words are skipped, edits made to the text since processing are replaced.
+    Returns the counts of receipts reparsed, skipped and failed.
+    """
+    with_words = receipts.exclude(ocr_words='').exclude(ocr_words__isnull=True)
+    counts = {'reparsed': 0, 'skipped': receipts.count() - with_words.count(), 'failed': 0}
+
+    batch = []
+    user_ids = set(with_words.values_list('user_id', flat=True).distinct())
+    with deferred_summary(*user_ids):
+        for receipt in with_words.iterator(chunk_size=REPARSE_BATCH_SIZE):
+            try:
+                with receipt.ocr_words.open('rb') as words_file:
+                    receipt.text = words_to_text(decode_words(words_file.read()))
+                save_products(receipt)
+                save_receipt_text(receipt)
+            except Exception as e:
+                logger.error(f"Error reparsing receipt {receipt.pk}: {str(e)}")
+                counts['failed'] += 1
+                continue
+
+            batch.append(receipt)
+            if len(batch) >= REPARSE_BATCH_SIZE:
+                Receipt.objects.bulk_update(batch, ['text'])
+                batch = []
+            counts['reparsed'] += 1
+
+        Receipt.objects.bulk_update(batch, ['text'])
+
+    logger.info(f"Reparsed receipts from stored OCR words: {json.dumps(counts)}")
+    return counts
@@ -1,29 +1,33 @@
 # receiptreader/signals.py
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import post_save, post_delete, pre_save
 from django.dispatch import receiver
-from .models import Product, UserSummary
-from django.db.models import Avg, Sum
-from decimal import Decimal
+from .models import Product
+from .summary import apply_product_change, is_deferred
+
+
+@receiver(pre_save, sender=Product)
+def remember_previous_product(sender, instance, **kwargs):
+    instance._summary_previous = None
+    if instance._state.adding or instance.pk is None or is_deferred(instance.user_id):
+        return
+
+    instance._summary_previous = Product.objects.filter(pk=instance.pk).values_list('user_id', 'category', 'price').first()
+
 
 @receiver(post_save, sender=Product)
-@receiver(post_delete, sender=Product)
 def update_user_summary(sender, instance, **kwargs):
-    user = instance.user
-
-    total_spent = Product.objects.filter(user=user).aggregate(total=Sum('price'))['total'] or 0.00
-
-    category_data = Product.objects.filter(user=user).values('category').annotate(
-        total_price=Sum('price'),
-        avg_price=Avg('price')
-    )
-    category_avg = {data['category']: round(float(data['avg_price']), 2) for data in category_data}
-    category_summary = {data['category']: float(data['total_price']) for data in category_data}
-
-    UserSummary.objects.update_or_create(
-        user=user,
-        defaults={
-            'total_spent': float(total_spent),
-            'category_avg': category_avg,
-            'category_summary': category_summary
-        }
-    )
+    previous = getattr(instance, '_summary_previous', None)
+    current = (instance.category, instance.price)
+
+    if previous is None:
+        apply_product_change(instance.user_id, added=current)
+    elif previous[0] == instance.user_id:
+        apply_product_change(instance.user_id, removed=previous[1:], added=current)
+    else:
+        apply_product_change(previous[0], removed=previous[1:])
+        apply_product_change(instance.user_id, added=current)
+
+
+@receiver(post_delete, sender=Product)
+def remove_from_user_summary(sender, instance, **kwargs):
+    apply_product_change(instance.user_id, removed=(instance.category, instance.price))
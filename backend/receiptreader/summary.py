@@ -0,0 +1,154 @@
+# receiptreader/summary.py
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from .models import Product, UserSummary
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+CENT = Decimal('0.01')
+# JSONField stores a None dict key as "null", use the same key in memory so both forms match.
+NULL_CATEGORY = 'null'
+
+_deferred = threading.local()
+
+
+def category_key(category):
+    return NULL_CATEGORY if category is None else category
+
+
+def to_cents(value):
+    if value is None:
+        return None
+    if isinstance(value, float):
+        value = str(value)
+    return Decimal(value).quantize(CENT)
+
+
+def _deferred_users():
+    if not hasattr(_deferred, 'users'):
+        _deferred.users = Counter()
+    return _deferred.users
+
+
+def _store(summary, counts, sums):
+    """
+    Writes per-category [products, priced products] counts and price sums into the summary fields.
+
+    Averages are taken over priced products only, like Avg('price') ignores NULL prices.
+    """
+    summary.category_count = counts
+    summary.category_summary = {key: float(sums[key]) for key in counts}
+    summary.category_avg = {
+        key: round(float(sums[key] / priced), 2) if priced else 0.0
+        for key, (_, priced) in counts.items()
+    }
+    summary.total_spent = sum(sums.values(), Decimal('0.00'))
+
+
+def recompute_summary(user_id):
+    rows = Product.objects.filter(user_id=user_id).values('category').annotate(
+        total_price=Sum('price'),
+        priced=Count('price'),
+        products=Count('id')
+    )
+
+    counts, sums = {}, {}
+    for row in rows:
+        key = category_key(row['category'])
+        counts[key] = [row['products'], row['priced']]
+        sums[key] = to_cents(row['total_price']) or Decimal('0.00')
+
+    summary, _ = UserSummary.objects.get_or_create(user_id=user_id)
+    _store(summary, counts, sums)
+    summary.save()
+    logger.debug(f"Recomputed summary for user {user_id}")
+    return summary
+
+
+def apply_product_change(user_id, removed=None, added=None):
+    """
+    Moves one product out of and/or into the summary of a user.
+
+    Parameters:
+        user_id (int): Owner of the product.
+        removed (tuple): (category, price) the product had before, None for a new product.
+        added (tuple): (category, price) the product has now, None for a deleted product.
+    """
+    if is_deferred(user_id):
+        return
+
+    with transaction.atomic():
+        summary = UserSummary.objects.select_for_update().filter(user_id=user_id).first()
+        if summary is None:
+            # Nothing to update while the owner is being deleted, a first product builds the summary from scratch.
+            if added is not None:
+                recompute_summary(user_id)
+            return
+
+        counts = summary.category_count
+        if set(counts) != set(summary.category_summary):
+            # Summary written before counts were tracked.
+            recompute_summary(user_id)
+            return
+
+        sums = {key: to_cents(value) for key, value in summary.category_summary.items()}
+        for change, sign in ((removed, -1), (added, 1)):
+            if change is None:
+                continue
+
+            category, price = change
+            key = category_key(category)
+            products, priced = counts.get(key, [0, 0])
+            products += sign
+            if price is not None:
+                priced += sign
+                sums[key] = sums.get(key, Decimal('0.00')) + sign * to_cents(price)
+
+            if products > 0:
+                counts[key] = [products, priced]
+                sums.setdefault(key, Decimal('0.00'))
+            else:
+                counts.pop(key, None)
+                sums.pop(key, None)
+
+        _store(summary, counts, sums)
+        summary.save()
+
+
+def is_deferred(user_id):
+    return user_id in _deferred_users()
+
+
+@contextmanager
+def deferred_summary(*users):
+    """
+    Skips per-product summary updates for the given users and recomputes each summary once on a clean exit.
+    """
+    user_ids = {getattr(user, 'pk', user) for user in users}
+    deferred = _deferred_users()
+    deferred.update(user_ids)
+    failed = False
+    try:
+        yield
+    except BaseException:
+        # The transaction around the block is not marked for rollback yet, recomputing in it would be rolled
+        # back anyway and on PostgreSQL would fail in the aborted transaction, hiding the original error.
+        failed = True
+        raise
+    finally:
+        deferred.subtract(user_ids)
+        released = {user_id for user_id in user_ids if deferred[user_id] <= 0}
+        for user_id in released:
+            del deferred[user_id]
+
+        if not failed and not transaction.get_connection().needs_rollback:
+            for user_id in released:
+                recompute_summary(user_id)
@@ -1,13 +1,76 @@
 # receiptreader/tests.py
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import cv2
+import numpy as np
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.core.management import CommandError, call_command
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from django.utils import timezone
 from decimal import Decimal
 from rest_framework import status
 from rest_framework.test import APIClient
 
-from .utils import parse_receipt_text
-from .models import User, Receipt, Product, UserSummary
+from . import derivatives, ocr_cache
+from .executor import get_pool, shutdown_pool, submit, wait_for
+from .metrics import render_metrics
+from bench.synthetic import synthetic_binary_receipt, synthetic_receipt
+from imagemaneger import PSM_SINGLE_LINE, bands_to_text, bands_to_words, compress_binary_string, image_to_json, json_to_image
+import ocr_backends
+from ocr_words import decode_words, encode_words, mean_confidence, parse_tsv, shift_words, stack_lines, words_to_text
+from pipeline import decode_image, process_image, read_variants
+from profiling import call_profiled
+from preprocessing import (BINARIZE_VARIANTS, SKEW_REFINE_CANDIDATES, add_and_average, binarize, crop_above_barcode, crop_to_text, estimate_skew,
+                           find_text_bands, find_text_region, gaussian_mask, open_binary_image, otsu_mask, preprocess, skew_search_angles)
+from .jobs import enqueue_receipt
+from .services import process_receipt_image, record_stages, save_products, stage_wall_seconds, upload_buffer
+from .summary import deferred_summary, is_deferred, recompute_summary
+from .utils import iter_receipt_products, parse_receipt_text
+from .models import ProcessingJob, User, Receipt, Product, UserSummary
+
+
+def make_image_upload(name="receipt.png"):
+    _, encoded = cv2.imencode(".png", np.full((20, 20, 3), 255, dtype=np.uint8))
+    return SimpleUploadedFile(name, encoded.tobytes(), content_type="image/png")
+
+
+def make_words(*lines, conf=90):
+    header = "level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\tleft\ttop\twidth\theight\tconf\ttext"
+    rows = [f"5\t1\t1\t1\t{line}\t{word}\t{word * 50}\t{line * 40}\t40\t30\t{conf}\t{text}"
+            for line, words in enumerate(lines, 1) for word, text in enumerate(words.split(), 1)]
+    return parse_tsv("\n".join([header, *rows]))
+
+
+class TempMediaRootMixin:
+    """
+    Runs every test with MEDIA_ROOT in a temporary directory and the overrides of media_settings.
+    """
+    media_settings: dict = {}
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = self.make_temp_dir()
+        self.enable_settings(MEDIA_ROOT=self.media_root, **self.media_settings)
+
+    def make_temp_dir(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        return directory
+
+    def enable_settings(self, **overrides):
+        settings_override = override_settings(**overrides)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
 
 
 class UserModelTest(TestCase):
@@ -129,6 +192,133 @@ class UserSummaryTestCase(TestCase):
         self.assertEqual(summary.category_summary["Groceries"], Decimal("20.00"))
 
 
+    def test_failed_deferred_block_skips_recompute(self):
+        with mock.patch("receiptreader.summary.recompute_summary") as recompute_mock:
+            with self.assertRaisesMessage(ValueError, "parse failed"):
+                with transaction.atomic(), deferred_summary(self.user):
+                    Product.objects.create(name="Product 4", price=Decimal("40.00"), receipt=self.receipt, user=self.user)
+                    raise ValueError("parse failed")
+
+            recompute_mock.assert_not_called()
+            with deferred_summary(self.user):
+                pass
+            recompute_mock.assert_called_once_with(self.user.pk)
+
+        self.assertFalse(is_deferred(self.user.pk))
+        self.assertEqual(UserSummary.objects.get(user=self.user).total_spent, Decimal("80.00"))
+
+    def test_incremental_updates_match_recompute(self):
+        self.product1.price = Decimal("12.50")
+        self.product1.save()
+        self.product2.category = "Electronics"
+        self.product2.save()
+        self.product3.category = None
+        self.product3.save()
+        Product.objects.create(name="Free sample", price=None, category="Groceries", receipt=self.receipt, user=self.user)
+        Product.objects.create(name="Product 5", price=Decimal("0.01"), category="Groceries", receipt=self.receipt, user=self.user)
+        self.product2.delete()
+
+        summary = UserSummary.objects.get(user=self.user)
+        incremental = (summary.total_spent, summary.category_avg, summary.category_summary, summary.category_count)
+        summary = recompute_summary(self.user.pk)
+        summary.refresh_from_db()
+
+        self.assertEqual(incremental, (summary.total_spent, summary.category_avg, summary.category_summary, summary.category_count))
+        self.assertEqual(summary.total_spent, Decimal("62.51"))
+        self.assertEqual(summary.category_avg, {"Groceries": 6.25, "null": 50.0})
+        self.assertEqual(summary.category_summary, {"Groceries": 12.51, "null": 50.0})
+        self.assertEqual(summary.category_count, {"Groceries": [3, 2], "null": [1, 1]})
+
+    def test_save_products_recomputes_summary_once(self):
+        self.receipt.text = "Pizza &&15.98&& ##Food##\nMilk &&3.49&& ##Groceries##\nBread &&4.20&& ##Groceries##"
+
+        with mock.patch("receiptreader.summary.recompute_summary", wraps=recompute_summary) as recompute_mock:
+            save_products(self.receipt)
+
+        recompute_mock.assert_called_once_with(self.user.pk)
+        summary = UserSummary.objects.get(user=self.user)
+        self.assertEqual(summary.total_spent, Decimal("23.67"))
+        self.assertEqual(summary.category_summary, {"Food": 15.98, "Groceries": 7.69})
+        self.assertEqual(summary.category_avg, {"Food": 15.98, "Groceries": 3.85})
+
+    def test_save_products_only_writes_changed_lines(self):
+        self.receipt.text = "Pizza &&15.98&& ##Food##\nMilk &&3.49&& ##Groceries##\nBread &&4.20&& ##Groceries##"
+        save_products(self.receipt)
+        pizza, milk, bread = self.receipt.products.order_by('id')
+
+        self.receipt.text = "Pizza &&15.98&& ##Food##\nOat milk &&4.99&& ##Groceries##"
+        with self.assertNumQueries(9):
+            save_products(self.receipt)
+
+        products = list(self.receipt.products.order_by('id'))
+        self.assertEqual([product.pk for product in products], [pizza.pk, milk.pk])
+        self.assertEqual((products[1].name, products[1].price), ("Oat milk", Decimal("4.99")))
+        self.assertFalse(Product.objects.filter(pk=bread.pk).exists())
+        self.assertEqual(UserSummary.objects.get(user=self.user).category_summary, {"Food": 15.98, "Groceries": 4.99})
+
+    def test_summary_endpoint(self):
+        response = self.client.get(reverse('user-summary'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {
+            "total_spent": 80.0,
+            "category_avg": {"Groceries": 15.0, "Electronics": 50.0},
+            "category_summary": {"Groceries": 30.0, "Electronics": 50.0},
+        })
+
+
+class ReceiptListTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="testuser@example.com", username="testuser", password="testpassword") #type: ignore
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+        day = timezone.now().replace(microsecond=0)
+        self.receipts = []
+        for index in range(7):
+            # Pairs of receipts share a date, so the id has to break ties.
+            receipt = Receipt.objects.create(user=self.user, title=f"Receipt {index}", date_of_shopping=day - timezone.timedelta(days=index // 2))
+            Product.objects.bulk_create([
+                Product(name=f"Product {index}-{line}", price=Decimal("1.00"), category="Food", receipt=receipt, user=self.user)
+                for line in range(3)
+            ])
+            self.receipts.append(receipt)
+        Receipt.objects.create(user=User.objects.create_user(email="other@example.com", username="other", password="otherpassword")) #type: ignore
+
+    def test_unpaginated_listing_prefetches_products(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('receipt-list'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()), 7)
+        self.assertEqual(len(response.json()[0]["products"]), 3)
+
+    def test_keyset_pages_cover_every_receipt_once(self):
+        expected = [receipt.pk for receipt in sorted(self.receipts, key=lambda receipt: (receipt.date_of_shopping, receipt.pk), reverse=True)]
+
+        seen = []
+        url = reverse('receipt-list') + "?page_size=3"
+        while url:
+            with self.assertNumQueries(2):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.json()["results"]), 3)
+            seen.extend(receipt["id"] for receipt in response.json()["results"])
+            url = response.json()["next"]
+
+        self.assertEqual(seen, expected)
+
+    def test_lightweight_listing_skips_products(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('receipt-list'), {"page_size": 5, "include_products": "false"})
+
+        self.assertEqual(len(response.json()["results"]), 5)
+        self.assertNotIn("products", response.json()["results"][0])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('receipt-list'), {"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
 class ReceiptTextParsingTest(TestCase):
 
     def test_valid_receipt_text(self):
@@ -178,6 +368,28 @@ class ReceiptTextParsingTest(TestCase):
         self.assertEqual(products[1]["price"], Decimal("1.50"))
         self.assertEqual(products[1]["category"], "Drink")
 
+    def test_irregular_markers(self):
+        receipt_text = "&&1##Food##2&& Cola\n##Food & Drink## Juice &&3,50&&\n\n&&4.00&& Tea"
+        products = parse_receipt_text(receipt_text)
+
+        self.assertEqual([(product["name"], product["price"], product["category"]) for product in products], [
+            ("Cola", Decimal("12"), "Food"),
+            ("Juice", Decimal("3.50"), "Food & Drink"),
+            ("Unnamed Product", Decimal("0"), "Uncategorized"),
+            ("Tea", Decimal("4.00"), "Uncategorized"),
+        ])
+
+    def test_invalid_lines_reported_once(self):
+        receipt_text = "Pizza &&15.98&& ##Food##\nBad &&1.2.3&& ##Misc##\nWorse &&999999&& ##Misc##"
+
+        with self.assertLogs('receiptreader.utils', level='WARNING') as logs:
+            products = iter_receipt_products(receipt_text)
+            self.assertEqual(next(products)["name"], "Pizza")
+            self.assertEqual(list(products), [])
+
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn("Skipped 2 invalid receipt lines", logs.output[0])
+
     def test_with_only_name(self):
         receipt_text = "InvalidLineWithoutMarkers"
         products = parse_receipt_text(receipt_text)
@@ -253,6 +465,49 @@ class ProductsByCategoryTest(TestCase):
         self.assertEqual(len(response.json()), 1)
         self.assertEqual(response.json()[0]["name"], "Other Product")
 
+    def test_get_products_by_category_single_query(self):
+        Product.objects.bulk_create([
+            Product(name=f"Extra {index}", price=Decimal("5.00"), category="Food", receipt=self.receipt2, user=self.user)
+            for index in range(10)
+        ])
+
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('products-by-category', args=['Food']))
+
+        self.assertEqual(len(response.json()), 12)
+        self.assertEqual(response.json()[0], {
+            "id": self.product2.id,
+            "name": "Product 2",
+            "price": 20.0,
+            "receipt_title": "Receipt 1",
+            "receipt_date": response.json()[0]["receipt_date"],
+        })
+        self.assertEqual(response.json()[-1]["receipt_title"], "Receipt 2")
+
+    def test_get_products_by_category_paginated(self):
+        Product.objects.create(name="Free", price=None, category="Food", receipt=self.receipt2, user=self.user)
+        Product.objects.create(name="Product 1 again", price=Decimal("10.00"), category="Food", receipt=self.receipt2, user=self.user)
+
+        names = []
+        url = reverse('products-by-category', args=['Food']) + "?page_size=2"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            names.extend(product["name"] for product in response.json()["results"])
+            url = response.json()["next"]
+
+        self.assertEqual(names, ["Product 2", "Product 1 again", "Product 1", "Free"])
+
+    def test_get_products_by_category_streamed(self):
+        response = self.client.get(reverse('products-by-category', args=['Food']))
+        streamed = self.client.get(reverse('products-by-category', args=['Food']), {"stream": "1"})
+
+        self.assertTrue(streamed.streaming)
+        self.assertEqual(b"".join(streamed.streaming_content), response.content)
+
+        missing = self.client.get(reverse('products-by-category', args=['Toys']), {"stream": "1"})
+        self.assertEqual(missing.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_get_products_by_category_not_authenticated(self):
         self.client.logout()
         response = self.client.get(reverse('products-by-category', args=['Food']))
@@ -294,4 +549,841 @@ class ProductDetailViewTest(TestCase):
     def test_unauthorized_access(self):
         self.client.force_authenticate(user=self.other_user) #type: ignore
         response = self.client.get(reverse('product-detail', args=[self.product.id]))
-        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
\ No newline at end of file
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ProcessingJobTest(TempMediaRootMixin, TestCase):
+    media_settings = {"RECEIPT_PROCESSING_ASYNC": False, "RECEIPT_PROCESSING_MAX_ATTEMPTS": 3,
+                      "RECEIPT_POOL_WORKERS": 0, "OCR_CACHE_MAX_BYTES": 0}
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email="testuser@example.com", username="testuser", password="testpassword") #type: ignore
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.receipt = Receipt.objects.create(user=self.user, title="Test Receipt")
+
+    @mock.patch("receiptreader.jobs.store_processed_receipt")
+    def test_job_succeeds(self, store_mock):
+        job = enqueue_receipt(self.receipt)
+
+        store_mock.assert_called_once()
+        self.assertEqual(job.status, ProcessingJob.STATUS_DONE)
+        self.assertEqual(job.attempts, 1)
+
+    @mock.patch("receiptreader.jobs.store_processed_receipt", side_effect=[Exception("OCR failed"), None])
+    def test_job_retries_after_failure(self, store_mock):
+        job = enqueue_receipt(self.receipt)
+
+        self.assertEqual(store_mock.call_count, 2)
+        self.assertEqual(job.status, ProcessingJob.STATUS_DONE)
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual(job.error, "")
+
+    @mock.patch("receiptreader.jobs.store_processed_receipt", side_effect=Exception("OCR failed"))
+    def test_job_fails_after_max_attempts(self, store_mock):
+        job = enqueue_receipt(self.receipt)
+
+        self.assertEqual(store_mock.call_count, 3)
+        self.assertEqual(job.status, ProcessingJob.STATUS_FAILED)
+        self.assertEqual(job.error, "OCR failed")
+
+    @override_settings(RECEIPT_PROCESSING_ASYNC=True)
+    @mock.patch("receiptreader.services.process_image_buffer", return_value=(b"processed", "Pizza &&15.98&&", b"words"))
+    @mock.patch("receiptreader.jobs.submit_job")
+    def test_create_receipt_returns_job(self, submit_mock, process_mock):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('receipt-create'), {"original_image": make_image_upload()}, format="multipart")
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        job = ProcessingJob.objects.get(pk=response.json()["job"]["id"])
+        self.assertEqual(job.receipt_id, response.json()["id"])
+        self.assertEqual(response.json()["job"]["status"], ProcessingJob.STATUS_PENDING)
+        submit_mock.assert_called_once_with(job.pk, prepared=mock.ANY)
+        self.assertEqual(submit_mock.call_args.kwargs["prepared"].future.result()[0], (b"processed", "Pizza &&15.98&&", b"words"))
+
+    @mock.patch("receiptreader.services.process_image_file")
+    @mock.patch("receiptreader.services.process_image_buffer", return_value=(b"processed", "Pizza &&15.98&&", b"words"))
+    def test_upload_is_processed_from_memory(self, buffer_mock, file_mock):
+        upload = make_image_upload()
+        response = self.client.post(reverse('receipt-create'), {"original_image": upload}, format="multipart")
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()["job"]["status"], ProcessingJob.STATUS_DONE)
+        file_mock.assert_not_called()
+        buffer_mock.assert_called_once()
+        self.assertIsInstance(buffer_mock.call_args.args[0], memoryview)
+
+        receipt = Receipt.objects.get(pk=response.json()["id"])
+        self.assertEqual(receipt.text, "Pizza &&15.98&&")
+        with receipt.processed_image.open("rb") as processed_file:
+            self.assertEqual(processed_file.read(), b"processed")
+        with receipt.ocr_words.open("rb") as words_file:
+            self.assertEqual(words_file.read(), b"words")
+
+    @mock.patch("receiptreader.services.process_image_buffer", return_value=(b"processed", "Pizza &&15.98&&", b"words"))
+    def test_batch_upload_returns_result_per_image(self, process_mock):
+        images = [make_image_upload("first.png"), SimpleUploadedFile("notes.txt", b"not an image"), make_image_upload("second.png")]
+        response = self.client.post(reverse('receipt-create-batch'), {"images": images}, format="multipart")
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        results = response.json()["results"]
+        self.assertEqual([result["filename"] for result in results], ["first.png", "notes.txt", "second.png"])
+        self.assertIn("original_image", results[1]["errors"])
+        self.assertEqual(process_mock.call_count, 2)
+
+        for result in (results[0], results[2]):
+            self.assertEqual(result["job"]["status"], ProcessingJob.STATUS_DONE)
+            self.assertEqual(result["job"]["receipt"], result["receipt"]["id"])
+            self.assertEqual(Receipt.objects.get(pk=result["receipt"]["id"]).text, "Pizza &&15.98&&")
+        self.assertEqual(Receipt.objects.filter(user=self.user).count(), 3)
+
+    @override_settings(RECEIPT_BATCH_MAX_IMAGES=1)
+    def test_batch_upload_limit(self):
+        images = [make_image_upload("first.png"), make_image_upload("second.png")]
+        response = self.client.post(reverse('receipt-create-batch'), {"images": images}, format="multipart")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Receipt.objects.filter(user=self.user).count(), 1)
+
+    def test_temporary_upload_is_memory_mapped(self):
+        content = make_image_upload().read()
+        upload = TemporaryUploadedFile("receipt.png", "image/png", len(content), None)
+        self.addCleanup(upload.close)
+        upload.write(content)
+        upload.flush()
+
+        with upload_buffer(upload) as buffer:
+            self.assertIsInstance(buffer, memoryview)
+            self.assertEqual(buffer.tobytes(), content)
+            self.assertEqual(decode_image(buffer).shape, (20, 20, 3))
+
+    def test_job_status_endpoint(self):
+        job = ProcessingJob.objects.create(receipt=self.receipt)
+
+        response = self.client.get(reverse('receipt-job', args=[job.pk]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["status"], ProcessingJob.STATUS_PENDING)
+        self.assertEqual(response.json()["receipt"], self.receipt.pk)
+
+    def test_job_status_hidden_from_other_users(self):
+        other_user = User.objects.create_user(email="otheruser@example.com", username="otheruser", password="otherpassword") #type: ignore
+        job = ProcessingJob.objects.create(receipt=Receipt.objects.create(user=other_user))
+
+        response = self.client.get(reverse('receipt-job', args=[job.pk]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_metrics_report_queue_depth(self):
+        ProcessingJob.objects.create(receipt=self.receipt)
+        ProcessingJob.objects.create(receipt=self.receipt, status=ProcessingJob.STATUS_DONE)
+        scraper = APIClient()
+
+        with override_settings(METRICS_TOKEN="scrape-secret"):
+            self.assertEqual(scraper.get(reverse('metrics')).status_code, status.HTTP_403_FORBIDDEN)
+            response = scraper.get(reverse('metrics'), HTTP_AUTHORIZATION="Bearer wrong-secret")
+            self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+            response = scraper.get(reverse('metrics'), HTTP_AUTHORIZATION="Bearer scrape-secret")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("receipt_jobs_queue_depth 1", response.content.decode())
+
+        self.assertEqual(scraper.get(reverse('metrics')).status_code, status.HTTP_403_FORBIDDEN)
+        with override_settings(METRICS_ALLOWED_IPS=("127.0.0.1",)):
+            self.assertEqual(scraper.get(reverse('metrics')).status_code, status.HTTP_200_OK)
+
+
+class OcrBackendTest(TestCase):
+
+    def setUp(self):
+        self.addCleanup(ocr_backends.configure, ocr_backends.current_backend())
+
+    def test_unknown_backend_is_rejected(self):
+        with self.assertRaises(ValueError):
+            ocr_backends.configure("easyocr")
+
+    @unittest.skipIf(ocr_backends.tesserocr is not None, "tesserocr is installed")
+    def test_tesserocr_falls_back_to_pytesseract(self):
+        self.assertEqual(ocr_backends.configure(ocr_backends.TESSEROCR), ocr_backends.PYTESSERACT)
+
+    @unittest.skipIf(ocr_backends.tesserocr is None, "tesserocr is not installed")
+    def test_tesserocr_engine_is_loaded_once(self):
+        ocr_backends.configure(ocr_backends.TESSEROCR)
+        image = synthetic_binary_receipt(600, 800)
+
+        ocr_backends.image_to_string(image, "pol")
+        with ocr_backends.checkout_engine("pol") as engine:
+            pass
+        text = ocr_backends.image_to_string(image, "pol")
+
+        with ocr_backends.checkout_engine("pol") as reused:
+            self.assertIs(reused, engine)
+        self.assertTrue(text.strip())
+
+
+
+class ReceiptReparseTest(TempMediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email="testuser@example.com", username="testuser", password="testpassword") #type: ignore
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def make_receipt(self, user, *lines):
+        receipt = Receipt.objects.create(user=user, original_image=make_image_upload(), text="old text")
+        if lines:
+            receipt.ocr_words.save("ocr_words.npz", ContentFile(encode_words(make_words(*lines))))
+        return receipt
+
+    def test_receipts_are_rebuilt_from_stored_words(self):
+        receipt = self.make_receipt(self.user, "Pizza &&15.98&&", "Cola &&4.50&&")
+        unprocessed = self.make_receipt(self.user)
+        other_user = User.objects.create_user(email="other@example.com", username="other", password="testpassword") #type: ignore
+        other_receipt = self.make_receipt(other_user, "Bread &&3.20&&")
+
+        with mock.patch("pipeline.image_to_words") as ocr_mock:
+            response = self.client.post(reverse('receipt-reparse'), {}, format="json")
+
+        ocr_mock.assert_not_called()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {"reparsed": 1, "skipped": 1, "failed": 0})
+        receipt.refresh_from_db()
+        self.assertEqual(receipt.text, "Pizza &&15.98&&\nCola &&4.50&&")
+        self.assertEqual(sorted(receipt.products.values_list("name", "price")), [("Cola", Decimal("4.50")), ("Pizza", Decimal("15.98"))])
+        self.assertEqual(UserSummary.objects.get(user=self.user).total_spent, Decimal("20.48"))
+        self.assertEqual(Receipt.objects.get(pk=unprocessed.pk).text, "old text")
+        self.assertEqual(Receipt.objects.get(pk=other_receipt.pk).text, "old text")
+
+    def test_listed_receipts_only(self):
+        first = self.make_receipt(self.user, "Pizza &&15.98&&")
+        second = self.make_receipt(self.user, "Cola &&4.50&&")
+
+        response = self.client.post(reverse('receipt-reparse'), {"ids": [second.pk]}, format="json")
+
+        self.assertEqual(response.json()["reparsed"], 1)
+        self.assertEqual(Receipt.objects.get(pk=first.pk).text, "old text")
+        self.assertEqual(Receipt.objects.get(pk=second.pk).text, "Cola &&4.50&&")
+
+    def test_invalid_ids_are_rejected(self):
+        response = self.client.post(reverse('receipt-reparse'), {"ids": "1,2"}, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_unreadable_words_are_counted_as_failed(self):
+        receipt = self.make_receipt(self.user, "Pizza &&15.98&&")
+        with open(receipt.ocr_words.path, "wb") as words_file:
+            words_file.write(b"not an archive")
+
+        response = self.client.post(reverse('receipt-reparse'), {}, format="json")
+
+        self.assertEqual(response.json(), {"reparsed": 0, "skipped": 0, "failed": 1})
+        self.assertEqual(Receipt.objects.get(pk=receipt.pk).text, "old text")
+
+
+class ReprocessReceiptsCommandTest(TempMediaRootMixin, TestCase):
+    media_settings = {"RECEIPT_POOL_WORKERS": 0, "OCR_CACHE_MAX_BYTES": 0}
+
+    def setUp(self):
+        super().setUp()
+        self.checkpoint = os.path.join(self.media_root, "checkpoint.json")
+
+        self.user = User.objects.create_user(email="testuser@example.com", username="testuser", password="testpassword") #type: ignore
+        other_user = User.objects.create_user(email="other@example.com", username="other", password="testpassword") #type: ignore
+        self.receipts = [Receipt.objects.create(user=self.user, original_image=make_image_upload(),
+                                                date_of_shopping=timezone.make_aware(timezone.datetime(2024, 1, day, 12)))
+                         for day in (1, 2, 3)]
+        self.other_receipt = Receipt.objects.create(user=other_user, original_image=make_image_upload())
+
+    def reprocess(self, *args):
+        output = io.StringIO()
+        call_command("reprocess_receipts", "--checkpoint", self.checkpoint, *args, stdout=output)
+        return output.getvalue()
+
+    @mock.patch("receiptreader.services.process_image_file", return_value=(b"processed", "Pizza &&15.98&&", b"words"))
+    def test_filtered_receipts_are_reprocessed(self, process_mock):
+        output = self.reprocess("--user", "testuser@example.com", "--since", "2024-01-02", "--chunk-size", "1")
+
+        self.assertEqual(process_mock.call_count, 2)
+        self.assertIn("2/2 receipts", output)
+        self.assertIn("ETA", output)
+        for receipt in self.receipts[1:]:
+            receipt.refresh_from_db()
+            self.assertEqual(receipt.text, "Pizza &&15.98&&")
+            self.assertEqual(list(receipt.products.values_list("name", flat=True)), ["Pizza"])
+        self.assertEqual(Receipt.objects.get(pk=self.receipts[0].pk).text, "")
+        self.assertEqual(UserSummary.objects.get(user=self.user).total_spent, Decimal("31.96"))
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    @mock.patch("receiptreader.services.process_image_file", return_value=(b"processed", "Pizza &&15.98&&", b"words"))
+    def test_interrupted_run_resumes_after_checkpoint(self, process_mock):
+        filters = {"users": [str(self.user.pk)], "since": None, "until": None}
+        with open(self.checkpoint, "w", encoding="utf-8") as checkpoint_file:
+            json.dump({"filters": filters, "last_pk": self.receipts[0].pk, "processed": 1, "failed": []}, checkpoint_file)
+
+        output = self.reprocess("--user", str(self.user.pk))
+
+        self.assertIn("Resuming after receipt", output)
+        self.assertIn("Reprocessed 3 receipts", output)
+        self.assertEqual(process_mock.call_count, 2)
+        self.assertEqual(Receipt.objects.get(pk=self.receipts[0].pk).text, "")
+
+        with open(self.checkpoint, "w", encoding="utf-8") as checkpoint_file:
+            json.dump({"filters": filters, "last_pk": 0, "processed": 0, "failed": []}, checkpoint_file)
+        with self.assertRaises(CommandError):
+            self.reprocess("--since", "2024-01-01")
+
+    def test_cached_results_are_not_reused(self):
+        with override_settings(OCR_CACHE_DIR=self.make_temp_dir(), OCR_CACHE_MAX_BYTES=1024 * 1024), \
+                mock.patch("receiptreader.services.process_image_file") as process_mock:
+            process_mock.return_value = (b"processed", "Pizza &&15.98&&", b"words")
+            self.reprocess("--user", "other@example.com")
+            process_mock.return_value = (b"processed", "Cola &&4.50&&", b"words")
+            self.reprocess("--user", "other@example.com")
+            self.assertEqual(process_mock.call_count, 2)
+            self.assertEqual(Receipt.objects.get(pk=self.other_receipt.pk).text, "Cola &&4.50&&")
+
+            self.reprocess("--user", "other@example.com", "--use-cache")
+            self.assertEqual(process_mock.call_count, 2)
+
+    @mock.patch("receiptreader.services.process_image_file", side_effect=ValueError("OCR failed"))
+    def test_failed_receipts_are_reported(self, process_mock):
+        output = self.reprocess("--chunk-size", "2")
+
+        self.assertEqual(process_mock.call_count, 4)
+        self.assertIn("failed: " + ", ".join(str(receipt.pk) for receipt in [*self.receipts, self.other_receipt]), output)
+
+
+class OcrWordsTest(TestCase):
+
+    tsv = "\n".join([
+        "level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\tleft\ttop\twidth\theight\tconf\ttext",
+        "1\t1\t0\t0\t0\t0\t0\t0\t600\t800\t-1\t",
+        "4\t1\t1\t1\t1\t0\t10\t20\t200\t30\t-1\t",
+        "5\t1\t1\t1\t1\t1\t10\t20\t90\t30\t90\tMLEKO",
+        "5\t1\t1\t1\t1\t2\t150\t20\t60\t30\t70\t3,49",
+        "5\t1\t1\t1\t2\t1\t10\t60\t80\t30\t95.5\tSUMA",
+        "5\t1\t1\t1\t2\t2\t100\t60\t50\t30\t40.5\tPLN",
+        "5\t1\t1\t1\t2\t3\t160\t60\t5\t30\t95\t ",
+        "5\t1\t2\t1\t1\t1\t10\t200\t90\t30\t80\tKARTA",
+    ])
+
+    def test_tsv_is_parsed_into_word_columns(self):
+        words = parse_tsv(self.tsv)
+
+        self.assertEqual(words["text"].tolist(), ["MLEKO", "3,49", "SUMA", "PLN", "KARTA"])
+        self.assertEqual(words["left"].tolist(), [10, 150, 10, 100, 10])
+        self.assertEqual(words["line_num"].dtype, np.uint16)
+        self.assertAlmostEqual(mean_confidence(words), 75.2, places=4)
+        self.assertEqual(words_to_text(words), "MLEKO 3,49\nSUMA PLN\n\nKARTA")
+
+    def test_empty_tsv_has_no_words(self):
+        words = parse_tsv(self.tsv.splitlines()[0])
+
+        self.assertEqual(words_to_text(words), "")
+        self.assertEqual(mean_confidence(words), 0.0)
+
+    def test_words_round_trip(self):
+        words = parse_tsv(self.tsv)
+
+        decoded = decode_words(encode_words(words))
+
+        self.assertEqual(set(decoded), set(words))
+        for column, values in words.items():
+            self.assertTrue(np.array_equal(decoded[column], values))
+            self.assertEqual(decoded[column].dtype, values.dtype)
+
+    def test_bands_are_stacked_into_consecutive_lines(self):
+        words = parse_tsv(self.tsv)
+
+        stacked = stack_lines([words, parse_tsv(""), shift_words(words, 5, 0)], [0, 300, 400])
+
+        self.assertEqual(words_to_text(stacked), "MLEKO 3,49\nSUMA PLN\nKARTA\nMLEKO 3,49\nSUMA PLN\nKARTA")
+        self.assertEqual(stacked["line_num"].tolist(), [1, 1, 2, 2, 3, 4, 4, 5, 5, 6])
+        self.assertEqual(stacked["top"].tolist()[5:], [420, 420, 460, 460, 600])
+        self.assertEqual(stacked["left"].tolist()[5:], [15, 155, 15, 105, 15])
+
+
+class TextBandTest(TestCase):
+
+    def test_one_band_per_line(self):
+        image = preprocess(synthetic_receipt(600, 1600, skew=2, line_height=20))
+
+        bands = find_text_bands(image)
+
+        self.assertEqual(len(bands), 39)
+        for (top, bottom), (next_top, _) in zip(bands, bands[1:]):
+            self.assertLess(top, bottom)
+            self.assertLessEqual(bottom, next_top)
+
+    def test_blank_image_has_no_bands(self):
+        self.assertEqual(find_text_bands(np.full((100, 100), 255, np.uint8)), [])
+
+    @mock.patch("imagemaneger.image_to_string", side_effect=lambda image, language, psm: f"{psm} {image.shape[0]}\n\x0c")
+    def test_bands_are_read_as_lines_in_order(self, ocr_mock):
+        image = synthetic_binary_receipt(600, 800)
+        bands = find_text_bands(image)
+
+        text = bands_to_text(image, "pol", workers=3)
+
+        self.assertEqual(text.splitlines(), [f"{PSM_SINGLE_LINE} {bottom - top}" for top, bottom in bands])
+        self.assertEqual(ocr_mock.call_count, len(bands))
+
+    def test_band_engines_are_reused_across_receipts(self):
+        tesserocr_mock = mock.MagicMock()
+        tesserocr_mock.PyTessBaseAPI.side_effect = lambda lang: mock.MagicMock(
+            GetTSVText=mock.Mock(return_value="5\t1\t1\t1\t1\t1\t0\t0\t40\t10\t90\tMLEKO\n"))
+        self.addCleanup(ocr_backends.configure, ocr_backends.current_backend())
+        image = synthetic_binary_receipt(600, 800)
+
+        with mock.patch.object(ocr_backends, "tesserocr", tesserocr_mock), mock.patch.dict(ocr_backends._engines, clear=True):
+            ocr_backends.configure(ocr_backends.TESSEROCR)
+            words = bands_to_words(image, "pol", workers=1)
+            bands_to_words(image, "pol", workers=1)
+            self.assertEqual(tesserocr_mock.PyTessBaseAPI.call_count, 1)
+
+            # Concurrent bands need more engines, but never more than read bands at once.
+            for _ in range(3):
+                bands_to_words(image, "pol", workers=3)
+            self.assertLessEqual(tesserocr_mock.PyTessBaseAPI.call_count, 3)
+
+        self.assertEqual(words["text"].size, len(find_text_bands(image)))
+
+
+class TextRegionTest(TestCase):
+
+    def text_page(self):
+        image = np.full((800, 600), 255, np.uint8)
+        for line in range(12):
+            cv2.putText(image, f"PRODUCT {line} 1 x{line},99", (150, 200 + line * 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, 0, 2)
+        return image
+
+    def test_region_holds_all_text(self):
+        image = self.text_page()
+        text_rows, text_columns = np.nonzero(image < 128)
+
+        x, y, width, height = find_text_region(image)
+
+        self.assertLessEqual(x, text_columns.min())
+        self.assertLessEqual(y, text_rows.min())
+        self.assertGreaterEqual(x + width, text_columns.max() + 1)
+        self.assertGreaterEqual(y + height, text_rows.max() + 1)
+
+    def test_paper_edges_are_cropped_away(self):
+        image = self.text_page()
+        box = find_text_region(image)
+        image[:, :8] = 0
+        image[:15, :] = 0
+        image[300:500, 585:592] = 0
+
+        cropped, eliminated, offset = crop_to_text(image)
+
+        self.assertEqual(find_text_region(image), box)
+        self.assertEqual(offset, box[:2])
+        self.assertEqual(cropped.shape, (box[3], box[2]))
+        self.assertAlmostEqual(eliminated, 1 - box[2] * box[3] / image.size)
+        self.assertGreater(eliminated, 0.3)
+
+    def test_blank_image_is_not_cropped(self):
+        image = np.full((100, 100), 255, np.uint8)
+
+        cropped, eliminated, offset = crop_to_text(image)
+
+        self.assertIsNone(find_text_region(image))
+        self.assertIs(cropped, image)
+        self.assertEqual((eliminated, offset), (0.0, (0, 0)))
+
+    @mock.patch("pipeline.image_to_words", side_effect=lambda image, language: make_words(f"{image.shape[1]}x{image.shape[0]}"))
+    def test_pipeline_reads_the_cropped_image(self, ocr_mock):
+        image = synthetic_receipt(600, 800, skew=2)
+
+        (encoded, text, words), stages = call_profiled(False, process_image, image, 'pol', None, 0, True)
+
+        processed = cv2.imdecode(np.frombuffer(encoded, np.uint8), cv2.IMREAD_GRAYSCALE)
+        cropped, eliminated, (left, top) = crop_to_text(processed)
+        self.assertEqual(text, f"{cropped.shape[1]}x{cropped.shape[0]}")
+        # Word boxes are given in the coordinates of the stored image, not of the crop.
+        self.assertEqual(decode_words(words)["left"].tolist(), [left + 50])
+        self.assertEqual(decode_words(words)["top"].tolist(), [top + 40])
+        record = next(record for record in stages if record['stage'] == "crop_to_text")
+        self.assertEqual(record['eliminated_fraction'], eliminated)
+        self.assertIn("crop_to_text.find_text_region", {record['stage'] for record in stages})
+
+
+class StageProfilingTest(TestCase):
+
+    def test_preprocessing_stages_are_recorded(self):
+        image = synthetic_receipt(600, 800, skew=3)
+
+        result, stages = call_profiled(True, preprocess, image)
+
+        self.assertTrue(np.array_equal(result, preprocess(image)))
+        by_name = {record['stage']: record for record in stages}
+        for name in ("detect_barcode", "crop_image", "binarize", "binarize.gaussian_mask", "binarize.otsu_mask",
+                     "correct_skew", "correct_skew.estimate_skew"):
+            self.assertIn(name, by_name)
+        binarize_record = by_name["binarize"]
+        self.assertGreater(binarize_record['wall_seconds'], 0)
+        self.assertGreater(binarize_record['peak_bytes'], 0)
+        self.assertGreaterEqual(binarize_record['peak_bytes'], by_name["binarize.otsu_mask"]['peak_bytes'])
+        self.assertGreaterEqual(binarize_record['wall_seconds'], by_name["binarize.gaussian_mask"]['wall_seconds'])
+
+    def test_stages_are_not_recorded_outside_a_profile(self):
+        _, stages = call_profiled(False, lambda: None)
+
+        self.assertEqual(stages, [])
+        self.assertNotIn("peak_bytes", call_profiled(False, binarize, synthetic_receipt(200, 300))[1][0])
+
+    @mock.patch("imagemaneger.image_to_data", side_effect=lambda image, language, psm: make_words("MLEKO"))
+    def test_band_stages_are_recorded_from_band_threads(self, ocr_mock):
+        image = synthetic_binary_receipt(600, 800)
+
+        words, stages = call_profiled(True, bands_to_words, image, "pol", 3)
+
+        band_records = [record for record in stages if record['stage'] == "bands_to_words.image_to_words"]
+        self.assertEqual(len(band_records), words["text"].size)
+        self.assertEqual(len(band_records), len(find_text_bands(image)))
+        bands_record = next(record for record in stages if record['stage'] == "bands_to_words")
+        self.assertGreaterEqual(bands_record['cpu_seconds'], sum(record['cpu_seconds'] for record in band_records))
+        # Child process CPU and peak memory are process wide, so band threads record neither.
+        self.assertIn('children_cpu_seconds', bands_record)
+        self.assertIn('peak_bytes', bands_record)
+        for record in band_records:
+            self.assertNotIn('children_cpu_seconds', record)
+            self.assertNotIn('peak_bytes', record)
+
+    def test_recorded_stages_feed_histograms(self):
+        count = stage_wall_seconds.count(stage="test_stage")
+
+        record_stages([{"stage": "test_stage", "wall_seconds": 0.02, "cpu_seconds": 0.01, "peak_bytes": 3 * 1024 * 1024}], "test")
+
+        self.assertEqual(stage_wall_seconds.count(stage="test_stage"), count + 1)
+        output = render_metrics()
+        self.assertIn("# TYPE receipt_stage_wall_seconds histogram", output)
+        self.assertIn('receipt_stage_wall_seconds_bucket{le="0.025",stage="test_stage"} ' + str(count + 1), output)
+        self.assertIn('receipt_stage_peak_bytes_bucket{le="+Inf",stage="test_stage"}', output)
+
+
+class PipelinePoolTest(TestCase):
+
+    @override_settings(RECEIPT_POOL_WORKERS=0)
+    def test_runs_inline_without_workers(self):
+        self.assertEqual(wait_for(submit(lambda value: value * 2, 21), "double"), 42)
+
+    @override_settings(RECEIPT_POOL_WORKERS=1, RECEIPT_POOL_TASK_TIMEOUT=60)
+    def test_runs_task_in_worker_process(self):
+        self.addCleanup(shutdown_pool)
+        self.assertEqual(wait_for(submit(max, 3, 7), "max"), 7)
+
+    @override_settings(RECEIPT_POOL_WORKERS=1, RECEIPT_POOL_TASK_TIMEOUT=60)
+    def test_running_task_timeout_terminates_the_pool(self):
+        self.addCleanup(shutdown_pool)
+        wait_for(submit(max, 0, 1), "max")
+        pool = get_pool()
+        workers = list(pool._processes.values())
+
+        with self.assertRaises(TimeoutError):
+            wait_for(submit(time.sleep, 30), "sleep", timeout=0.5)
+
+        for worker in workers:
+            worker.join(5)
+            self.assertFalse(worker.is_alive())
+        self.assertIsNot(get_pool(), pool)
+        self.assertEqual(wait_for(submit(max, 3, 7), "max"), 7)
+
+
+class OcrCacheTest(TempMediaRootMixin, TestCase):
+    media_settings = {"OCR_CACHE_MAX_BYTES": 1024 * 1024, "RECEIPT_POOL_WORKERS": 0}
+
+    def setUp(self):
+        super().setUp()
+        self.cache_dir = self.make_temp_dir()
+        self.enable_settings(OCR_CACHE_DIR=self.cache_dir)
+
+        self.user = User.objects.create_user(email="testuser@example.com", username="testuser", password="testpassword") #type: ignore
+        self.receipt = Receipt.objects.create(user=self.user, original_image=make_image_upload())
+
+    @mock.patch("receiptreader.services.process_image_file", return_value=(b"processed", "Pizza &&15.98&&", b"words"))
+    def test_duplicate_image_is_served_from_cache(self, process_mock):
+        hits = ocr_cache.cache_hits.value()
+
+        first_file, first_text, first_words = process_receipt_image(self.receipt)
+        second_file, second_text, second_words = process_receipt_image(self.receipt)
+
+        process_mock.assert_called_once()
+        self.assertEqual(first_text, second_text)
+        self.assertEqual(second_file.read(), b"processed")
+        self.assertEqual(second_words.read(), b"words")
+        self.assertEqual(ocr_cache.cache_hits.value(), hits + 1)
+
+    def test_key_depends_on_language_and_preprocessing(self):
+        path = self.receipt.original_image.path
+
+        self.assertEqual(ocr_cache.make_key(path, "pol"), ocr_cache.make_key(path, "pol"))
+        self.assertNotEqual(ocr_cache.make_key(path, "pol"), ocr_cache.make_key(path, "eng"))
+        self.assertNotEqual(ocr_cache.make_key(path, "pol"), ocr_cache.make_key(path, "pol", preprocess=False))
+
+    def test_key_depends_on_backend_and_pipeline_constants(self):
+        path = self.receipt.original_image.path
+        key = ocr_cache.make_key(path, "pol")
+
+        with override_settings(OCR_BACKEND=ocr_backends.TESSEROCR):
+            self.assertNotEqual(ocr_cache.make_key(path, "pol"), key)
+        for module, constant, value in (("preprocessing", "SKEW_COARSE_DEVIATION", 0.1), ("preprocessing", "BAND_MIN_GAP", 5),
+                                        ("preprocessing", "TEXT_REGION_MARGIN", 0), ("imagemaneger", "MULTI_LINE_BAND", 2.5)):
+            with mock.patch(f"{module}.{constant}", value):
+                self.assertNotEqual(ocr_cache.make_key(path, "pol"), key, constant)
+        self.assertEqual(ocr_cache.make_key(path, "pol"), key)
+
+    def test_entries_within_budget_do_not_scan_the_cache(self):
+        with mock.patch.object(ocr_cache, "evict", wraps=ocr_cache.evict) as evict_mock:
+            for index in range(3):
+                ocr_cache.put(f"entry{index}", "text", b"image", b"words")
+
+        evict_mock.assert_called_once()
+
+    @override_settings(OCR_CACHE_MAX_BYTES=100)
+    def test_least_recently_used_entries_are_evicted(self):
+        ocr_cache.put("old", "a" * 40)
+        ocr_cache.put("recent", "b" * 40)
+        ocr_cache.get("old", with_image=False)
+        os.utime(os.path.join(self.cache_dir, "recent.txt"), (0, 0))
+
+        ocr_cache.put("new", "c" * 40)
+
+        self.assertIsNotNone(ocr_cache.get("old", with_image=False))
+        self.assertIsNone(ocr_cache.get("recent", with_image=False))
+        self.assertIsNotNone(ocr_cache.get("new", with_image=False))
+
+
+class ShowReceiptImageTest(TempMediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email="testuser@example.com", username="testuser", password="testpassword") #type: ignore
+        self.receipt = Receipt.objects.create(user=self.user, original_image=make_image_upload())
+        with open(self.receipt.original_image.path, 'rb') as image_file:
+            self.content = image_file.read()
+        self.url = reverse('receipt-image', args=[self.receipt.pk, 'original_image', 'receipt.png'])
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_image_is_streamed_with_validators(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(b"".join(response.streaming_content), self.content)
+        self.assertEqual(response['Content-Type'], "image/png")
+        self.assertEqual(response['Accept-Ranges'], "bytes")
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+
+    def test_matching_validators_return_not_modified(self):
+        first = self.client.get(self.url)
+
+        by_etag = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        by_date = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+
+        self.assertEqual(by_etag.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(by_date.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(by_etag['ETag'], first['ETag'])
+
+    def test_byte_ranges(self):
+        size = len(self.content)
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=10-19")
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b"".join(response.streaming_content), self.content[10:20])
+        self.assertEqual(response['Content-Range'], f"bytes 10-19/{size}")
+        self.assertEqual(response['Content-Length'], "10")
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=-5")
+        self.assertEqual(b"".join(response.streaming_content), self.content[-5:])
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=5-")
+        self.assertEqual(b"".join(response.streaming_content), self.content[5:])
+
+        response = self.client.get(self.url, HTTP_RANGE=f"bytes={size}-")
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response['Content-Range'], f"bytes */{size}")
+
+    def test_stale_if_range_sends_whole_file(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE='"stale"')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b"".join(response.streaming_content), self.content)
+
+    @override_settings(RECEIPT_IMAGE_SENDFILE='x-accel-redirect', RECEIPT_IMAGE_ACCEL_PREFIX='/protected/')
+    def test_sendfile_leaves_bytes_to_proxy(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['X-Accel-Redirect'], f"/protected/{self.receipt.original_image.name}")
+        self.assertEqual(response.content, b"")
+
+
+class ReceiptImageDerivativeTest(TempMediaRootMixin, TestCase):
+    media_settings = {"RECEIPT_DERIVATIVE_WIDTHS": (160, 320)}
+
+    def setUp(self):
+        super().setUp()
+        _, encoded = cv2.imencode(".jpg", np.random.default_rng(0).integers(0, 256, (400, 800, 3), dtype=np.uint8))
+        self.user = User.objects.create_user(email="testuser@example.com", username="testuser", password="testpassword") #type: ignore
+        self.receipt = Receipt.objects.create(user=self.user, original_image=SimpleUploadedFile("receipt.jpg", encoded.tobytes()))
+        self.url = reverse('receipt-image', args=[self.receipt.pk, 'original_image', 'receipt.jpg'])
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def get_image(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, cv2.imdecode(np.frombuffer(b"".join(response.streaming_content), np.uint8), cv2.IMREAD_COLOR)
+
+    def test_width_is_snapped_and_cached(self):
+        misses = derivatives.derivative_misses.value()
+        hits = derivatives.derivative_hits.value()
+
+        response, image = self.get_image(width=200)
+        self.get_image(width=300 - 100)
+
+        self.assertEqual(image.shape[:2], (160, 320))
+        self.assertEqual(response['Content-Type'], "image/webp")
+        self.assertIn('receipt-320.webp', response['Content-Disposition'])
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, f"receipts/{self.receipt.unique_id}/derivatives/receipt-320.webp")))
+        self.assertEqual(derivatives.derivative_misses.value(), misses + 1)
+        self.assertEqual(derivatives.derivative_hits.value(), hits + 1)
+
+    def test_jpeg_format_and_invalid_parameters(self):
+        response, image = self.get_image(width=100, image_format="jpeg")
+
+        self.assertEqual(response['Content-Type'], "image/jpeg")
+        self.assertEqual(image.shape[:2], (80, 160))
+        self.assertEqual(self.client.get(self.url, {'width': 'wide'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url, {'image_format': 'gif'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_replaced_source_is_rendered_again(self):
+        self.get_image(width=160)
+        derivative = os.path.join(self.media_root, f"receipts/{self.receipt.unique_id}/derivatives/receipt-160.webp")
+        os.utime(derivative, (0, 0))
+        misses = derivatives.derivative_misses.value()
+
+        self.get_image(width=160)
+
+        self.assertEqual(derivatives.derivative_misses.value(), misses + 1)
+
+    def test_misses_within_budget_do_not_scan_the_cache(self):
+        with mock.patch.object(derivatives, "evict", wraps=derivatives.evict) as evict_mock:
+            self.get_image(width=160)
+            self.get_image(width=320)
+            self.get_image(width=320, image_format="jpeg")
+
+        evict_mock.assert_called_once()
+
+    def test_undecodable_image_is_served_unscaled(self):
+        receipt = Receipt.objects.create(user=self.user, original_image=SimpleUploadedFile("broken.jpg", b"not an image"))
+        url = reverse('receipt-image', args=[receipt.pk, 'original_image', 'broken.jpg'])
+
+        response = self.client.get(url, {'width': 160})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b"".join(response.streaming_content), b"not an image")
+
+    def test_least_recently_used_derivatives_are_evicted(self):
+        self.get_image(width=160)
+        derivative = os.path.join(self.media_root, f"receipts/{self.receipt.unique_id}/derivatives/receipt-160.webp")
+
+        with override_settings(RECEIPT_DERIVATIVE_CACHE_MAX_BYTES=os.path.getsize(derivative) + 1):
+            self.get_image(width=320)
+
+        self.assertFalse(os.path.exists(derivative))
+        self.assertTrue(os.path.exists(derivative.replace("-160", "-320")))
+
+
+class ImageJsonTest(TestCase):
+
+    def test_binary_image_round_trip(self):
+        image = np.where(np.random.default_rng(0).random((40, 30)) > 0.5, 255, 0).astype(np.uint8)
+        self.assertTrue(np.array_equal(json_to_image(image_to_json(image)), image))
+
+    def test_grayscale_image_round_trip(self):
+        image = np.random.default_rng(0).integers(0, 256, (40, 30)).astype(np.uint8)
+        self.assertTrue(np.array_equal(json_to_image(image_to_json(image)), image))
+
+    def test_legacy_payload_is_decoded(self):
+        image = np.zeros((4, 5), dtype=np.uint8)
+        image[1:3, 2:] = 255
+        legacy_json = json.dumps({"image": compress_binary_string(image.tobytes().hex()), "height": 4, "width": 5})
+
+        self.assertTrue(np.array_equal(json_to_image(legacy_json), image))
+
+
+class PreprocessingTest(TestCase):
+
+    def setUp(self):
+        self.image = synthetic_receipt(900, 1200, skew=3)
+
+    def test_pyramid_mode_matches_full_resolution(self):
+        full = preprocess(self.image)
+        pyramid = preprocess(self.image, working_width=450)
+
+        self.assertEqual(pyramid.ndim, 2)
+        self.assertAlmostEqual(pyramid.shape[0], full.shape[0], delta=full.shape[0] * 0.02)
+        self.assertAlmostEqual(pyramid.shape[1], full.shape[1], delta=full.shape[1] * 0.02)
+
+    def test_pyramid_mode_ignored_for_small_images(self):
+        self.assertTrue(np.array_equal(preprocess(self.image, working_width=2000), preprocess(self.image)))
+
+    def test_skew_is_estimated(self):
+        self.assertAlmostEqual(estimate_skew(self.image), -3, delta=1)
+
+    def test_coarse_skew_search_matches_full_sweep(self):
+        for skew in (-12, -4, 0, 7, 13):
+            image = synthetic_receipt(600, 800, skew=skew)
+            full = estimate_skew(image, min_angle=None, max_angle=None, coarse_deviation=None)
+            self.assertAlmostEqual(estimate_skew(image), full, places=6)
+
+    def test_coarse_skew_search_sweeps_fewer_angles(self):
+        grid, window, coarse_stride, coarse = skew_search_angles()
+        self.assertLess(coarse.size + SKEW_REFINE_CANDIDATES * (2 * coarse_stride - 1), grid.size / 4)
+
+    def test_fused_binarize_matches_separate_masks(self):
+        for image in (self.image, cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)[10:-10, 5:]):
+            gaussian_image = open_binary_image(gaussian_mask(image), (3, 3), (2, 2))
+            otsu_image = open_binary_image(otsu_mask(image), (3, 3), (2, 2))
+            expected = open_binary_image(add_and_average(otsu_image, gaussian_image), (2, 2), (2, 2))
+
+            binary_image = binarize(image)
+            self.assertEqual(binary_image.dtype, np.uint8)
+            self.assertTrue(np.array_equal(binary_image, expected))
+
+    def test_single_mask_variants(self):
+        expected = {
+            "otsu": open_binary_image(otsu_mask(self.image), (3, 3), (2, 2)),
+            "gaussian": open_binary_image(gaussian_mask(self.image), (3, 3), (2, 2)),
+        }
+        for variant, expected_image in expected.items():
+            self.assertTrue(np.array_equal(binarize(self.image, variant), expected_image))
+        self.assertFalse(np.array_equal(binarize(self.image, "combined_wide"), binarize(self.image)))
+
+        with self.assertRaises(ValueError):
+            binarize(self.image, "sauvola")
+
+    @mock.patch("imagemaneger.image_to_data",
+                side_effect=lambda image, language, psm: make_words(str(image.shape[0]), conf=100 * float(np.mean(image == 255))))
+    def test_variant_read_with_best_confidence_is_kept(self, ocr_mock):
+        variants = tuple(BINARIZE_VARIANTS)
+        processed = {variant: preprocess(self.image, variant=variant) for variant in variants}
+        best = max(variants, key=lambda variant: np.mean(processed[variant] == 255))
+
+        (image, words), stages = call_profiled(False, read_variants, self.image, 'pol', None, variants)
+
+        self.assertTrue(np.array_equal(image, processed[best]))
+        self.assertEqual(words_to_text(words), str(processed[best].shape[0]))
+        self.assertEqual(ocr_mock.call_count, len(variants))
+        record = next(record for record in stages if record['stage'] == "read_variants")
+        self.assertEqual(record['variant'], best)
+        self.assertEqual(set(record['confidences']), set(variants))
+        recorded = {record['stage'] for record in stages}
+        for variant in variants:
+            for name in ("binarize", "correct_skew", "image_to_words"):
+                self.assertIn(f"read_variants.{variant}.{name}", recorded)
+
+    def test_barcode_at_top_keeps_image(self):
+        self.assertIs(crop_above_barcode(self.image, (300, 30, 200, 40)), self.image)
@@ -2,7 +2,7 @@
 from django.urls import path
 
 from . import views
-from .views import ChangePasswordView, ProductDetailView, ProductsByCategoryView, ProductsByReceiptView, RegisterView, LoginView, ReceiptListView, ReceiptDetailView, ShowReceiptImage, UserListView, UserDetailView, ReceiptCreateView, UpdateReceiptView, DeleteReceiptView, LogoutAPIView, UserSummaryView
+from .views import ChangePasswordView, ProductDetailView, ProductsByCategoryView, ProductsByReceiptView, RegisterView, LoginView, ReceiptListView, ReceiptDetailView, ShowReceiptImage, UserListView, UserDetailView, ReceiptCreateView, ReceiptBatchCreateView, UpdateReceiptView, DeleteReceiptView, LogoutAPIView, UserSummaryView, ProcessingJobStatusView, MetricsView, ReceiptReparseView
 from rest_framework_simplejwt.views import TokenRefreshView
 
 urlpatterns = [
@@ -14,6 +14,9 @@ urlpatterns = [
     path('receipts/', ReceiptListView.as_view(), name='receipt-list'),
     path('receipt/<int:pk>/', ReceiptDetailView.as_view(), name='receipt-detail'),
     path('receipt/create/', ReceiptCreateView.as_view(), name='receipt-create'),
+    path('receipt/create/batch/', ReceiptBatchCreateView.as_view(), name='receipt-create-batch'),
+    path('receipt/job/<int:pk>/', ProcessingJobStatusView.as_view(), name='receipt-job'),
+    path('receipts/reparse/', ReceiptReparseView.as_view(), name='receipt-reparse'),
     path('receipt/update/<int:pk>/', UpdateReceiptView.as_view(), name='receipt-update'),
     path('receipt/delete/<int:pk>/', DeleteReceiptView.as_view(), name='receipt-delete'),
     path('receipts/<int:pk>/image/<str:image_type>/<str:filename>/', ShowReceiptImage.as_view(), name='receipt-image'),
@@ -24,4 +27,5 @@ urlpatterns = [
     path('products/category/<str:category>/', ProductsByCategoryView.as_view(), name='products-by-category'),
     path('product/<int:pk>/', ProductDetailView.as_view(), name='product-detail'),
     path('products/<int:receipt_id>/', ProductsByReceiptView.as_view(), name='products-by-receipt'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
 ]
\ No newline at end of file
@@ -16,37 +16,84 @@ def get_client_ip(request):
     return ip
 
 
-def parse_receipt_text(receipt_text):
-    products = []
-    lines = receipt_text.strip().split("\n")
+CATEGORY_PATTERN = re.compile(r"##(.+?)##")
+PRICE_PATTERN = re.compile(r"&&([\d.,]+)&&")
+# One scan over the whole text matches every line. A line whose only '#' and '&' characters are a single
+# category and/or price marker is split by the first alternative, every other line falls through to the
+# second one and is parsed marker by marker with the patterns above.
+RECEIPT_LINE_PATTERN = re.compile(r"""
+    ^(?P<head>[^#&\n]*)
+    (?:
+        \#\#(?P<category>[^#&\n]+)\#\#(?P<middle>[^#&\n]*)
+        (?:&&(?P<price>[\d.,]+)&&(?P<tail>[^#&\n]*))?
+      | &&(?P<price_first>[\d.,]+)&&(?P<middle_price_first>[^#&\n]*)
+        (?:\#\#(?P<category_last>[^#&\n]+)\#\#(?P<tail_price_first>[^#&\n]*))?
+    )?$
+  | ^(?P<other>.*)$
+""", re.MULTILINE | re.VERBOSE)
+DEFAULT_CATEGORY = "Uncategorized"
+UNNAMED_PRODUCT = "Unnamed Product"
+MAX_PRICE = 200000
+ZERO_PRICE = Decimal(0.00)
 
-    for line in lines:
-        try:
-            category_match = re.search(r"##(.+?)##", line)
-            category = category_match.group(1).strip() if category_match else "Uncategorized"
-            if category_match:
-                line = line.replace(category_match.group(0), "").strip()
 
-            price_match = re.search(r"&&([\d.,]+)&&", line)
-            price = Decimal(price_match.group(1).replace(",", ".")) if price_match else Decimal(0.00)
-            if price_match:
-                line = line.replace(price_match.group(0), "").strip()
+def _split_line_in_steps(line):
+    category_match = CATEGORY_PATTERN.search(line)
+    category = category_match.group(1).strip() if category_match else DEFAULT_CATEGORY
+    if category_match:
+        line = line.replace(category_match.group(0), "").strip()
 
-            name = line.strip()
-            if not name:
-                name = "Unnamed Product"
+    price_match = PRICE_PATTERN.search(line)
+    price = price_match.group(1) if price_match else None
+    if price_match:
+        line = line.replace(price_match.group(0), "").strip()
 
-            if price_match and (price < 0 or price > 200000):
-                raise ValueError(f"Price {price} is invalid.")
+    return line.strip(), price, category
+
+
+def iter_receipt_products(receipt_text):
+    """
+    Yields a product dict for every line of the OCR text, skipping lines with an invalid price.
+
+    Lines are matched lazily, so very long texts can be consumed without splitting them first.
+    Skipped lines are reported in one warning once the text is exhausted.
+    """
+    skipped = []
+    for match in RECEIPT_LINE_PATTERN.finditer(receipt_text.strip()):
+        (head, category, middle, price_text, tail,
+         price_first, middle_price_first, category_last, tail_price_first, other) = match.groups()
 
-            products.append({
-                "name": name,
-                "price": price,
-                "category": category
-            })
+        if other is not None:
+            name, price_text, category = _split_line_in_steps(other)
+        elif category is not None:
+            name = (head + middle + (tail or '')).strip()
+            category = category.strip()
+        elif price_first is not None:
+            name = (head + middle_price_first + (tail_price_first or '')).strip()
+            price_text = price_first
+            category = category_last.strip() if category_last is not None else DEFAULT_CATEGORY
+        else:
+            name = head.strip()
+            category = DEFAULT_CATEGORY
 
+        try:
+            price = Decimal(price_text.replace(",", ".")) if price_text is not None else ZERO_PRICE
+            if price_text is not None and (price < 0 or price > MAX_PRICE):
+                raise ValueError(f"Price {price} is invalid.")
         except (InvalidOperation, ValueError) as e:
-            logger.warning(f"Invalid line skipped: {line}. Error: {e}")
+            logger.debug(f"Invalid line skipped: {name}. Error: {e}")
+            skipped.append(f"{name}: {e}")
             continue
 
-    return products
\ No newline at end of file
+        yield {
+            "name": name or UNNAMED_PRODUCT,
+            "price": price,
+            "category": category
+        }
+
+    if skipped:
+        logger.warning(f"Skipped {len(skipped)} invalid receipt lines, first: {skipped[0]}")
+
+
+def parse_receipt_text(receipt_text):
+    return list(iter_receipt_products(receipt_text))
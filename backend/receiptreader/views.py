@@ -7,13 +7,25 @@ from rest_framework_simplejwt.tokens import RefreshToken, AccessToken
 from django.contrib.auth import get_user_model
 from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework_simplejwt.exceptions import TokenError
-from .services import extract_text_from_image, process_receipt_image, save_receipt_text, save_products
-from django.http import HttpResponse
+from .services import extract_text_from_image, prepare_receipt_upload, reparse_receipts, save_receipt_text, save_products, store_processed_receipt
+from .jobs import enqueue_receipt, enqueue_receipts
+from .derivatives import FORMATS as DERIVATIVE_FORMATS, get_derivative, snap_width
+from .downloads import serve_file
+from .metrics import render_metrics
+from .pagination import KeysetPagination, PriceKeysetPagination
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.http import HttpResponse, StreamingHttpResponse
+from rest_framework.parsers import MultiPartParser
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
 from rest_framework.views import APIView
-import mimetypes
+import hmac
+import itertools
 
-from .models import Product, Receipt, UserSummary
-from .serializers import ChangePasswordSerializer, ProductSerializer, UserSerializer, ReceiptSerializer, UserListSerializer, UpdateReceiptSerializer
+from .models import ProcessingJob, Product, Receipt, UserSummary
+from .serializers import ChangePasswordSerializer, ProcessingJobSerializer, ProductSerializer, UserSerializer, ReceiptSerializer, ReceiptListSerializer, UserListSerializer, UpdateReceiptSerializer
 from .utils import get_client_ip
 
 import logging
@@ -118,26 +130,26 @@ class ReceiptCreateView(BaseView, generics.CreateAPIView):
     serializer_class = ReceiptSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        if self.job is not None:
+            response.data['job'] = ProcessingJobSerializer(self.job).data
+        return response
+
     def perform_create(self, serializer):
         self.log_request('ReceiptCreateView', self.request)
+        self.job = None
         try:
+            upload = serializer.validated_data.get('original_image')
+            # Preprocessing and OCR run in the pool while the original is written to storage.
+            prepared = prepare_receipt_upload(upload) if upload else None
+
             instance = serializer.save(user=self.request.user)
             receipt_image = instance.original_image
             logger.debug(f"Received image: {receipt_image}")
 
             if receipt_image:
-                try:
-                    processed_image_file, instance.text = process_receipt_image(instance)
-
-                    original_filename = receipt_image.name.split('/')[-1]
-                    processed_filename = 'processed_' + original_filename
-                    instance.processed_image.save(processed_filename, processed_image_file)
-                    save_receipt_text(instance)
-                    instance.save()
-                    logger.info(f"Processed image saved for receipt {instance.pk}")
-                except Exception as e:
-                    logger.error(f"Image processing failed: {str(e)}", exc_info=True)
-                    raise ValidationError(f"Image processing failed: {str(e)}")
+                self.job = enqueue_receipt(instance, prepared)
             else:
                 logger.warning("No image provided for receipt creation")
         except Exception as e:
@@ -145,13 +157,82 @@ class ReceiptCreateView(BaseView, generics.CreateAPIView):
             raise
 
 
+class ReceiptBatchCreateView(BaseView, APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request, *args, **kwargs):
+        self.log_request('ReceiptBatchCreateView', request)
+        uploads = request.FILES.getlist('images')
+        if not uploads:
+            return Response({"error": "No images provided"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(uploads) > settings.RECEIPT_BATCH_MAX_IMAGES:
+            return Response({"error": f"At most {settings.RECEIPT_BATCH_MAX_IMAGES} images can be uploaded at once"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        context = {'request': request}
+        results = [None] * len(uploads)
+        valid = []
+        for index, upload in enumerate(uploads):
+            serializer = ReceiptSerializer(data={'original_image': upload}, context=context)
+            if serializer.is_valid():
+                valid.append((index, serializer.validated_data))
+            else:
+                logger.warning(f"Batch image {upload.name} rejected: {serializer.errors}")
+                results[index] = {'index': index, 'filename': upload.name, 'errors': serializer.errors}
+
+        # Every image starts preprocessing and OCR in the pool before the originals are stored,
+        # so the batch is spread over all pool workers instead of running one image at a time.
+        prepared = [prepare_receipt_upload(data['original_image']) for _, data in valid]
+
+        with transaction.atomic():
+            receipts = Receipt.objects.bulk_create([Receipt(user=request.user, **data) for _, data in valid])
+            jobs = enqueue_receipts(receipts, prepared)
+
+        for (index, _), receipt, job in zip(valid, receipts, jobs):
+            results[index] = {
+                'index': index,
+                'filename': uploads[index].name,
+                'receipt': ReceiptSerializer(receipt, context=context).data,
+                'job': ProcessingJobSerializer(job).data
+            }
+
+        logger.info(f"Batch of {len(uploads)} images created {len(receipts)} receipts for user {request.user.pk}")
+        response_status = status.HTTP_201_CREATED if receipts else status.HTTP_400_BAD_REQUEST
+        return Response({'results': results}, status=response_status)
+
+
+class ProcessingJobStatusView(BaseView, generics.RetrieveAPIView):
+    serializer_class = ProcessingJobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return ProcessingJob.objects.filter(receipt__user=self.request.user)
+
+    def retrieve(self, request, *args, **kwargs):
+        self.log_request('ProcessingJobStatusView', request)
+        return super().retrieve(request, *args, **kwargs)
+
+
 class ReceiptListView(BaseView, generics.ListCreateAPIView):
     serializer_class = ReceiptSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
+
+    def include_products(self):
+        return self.request.query_params.get('include_products', 'true').lower() not in ('0', 'false', 'no')
+
+    def get_serializer_class(self):
+        if self.request.method == 'GET' and not self.include_products():
+            return ReceiptListSerializer
+        return super().get_serializer_class()
 
     def get_queryset(self):
         self.log_request('ReceiptListView', self.request)
-        return Receipt.objects.filter(user=self.request.user)
+        queryset = Receipt.objects.filter(user=self.request.user)
+        if self.include_products():
+            queryset = queryset.prefetch_related('products')
+        return queryset
 
     def perform_create(self, serializer):
         self.log_request('ReceiptListView - Create', self.request)
@@ -190,11 +271,15 @@ class UpdateReceiptView(BaseView, generics.UpdateAPIView):
             logger.error(f"Serialization error: {serializer.errors}")
             return Response({"error": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
 
+        prepared = None
+        if 'original_image' in request.FILES and serializer.validated_data.get('original_image'):
+            prepared = prepare_receipt_upload(serializer.validated_data['original_image'])
+
         serializer.save()
 
         try:
             if 'original_image' in request.FILES:
-                self.reprocess_original_image(instance)
+                self.reprocess_original_image(instance, prepared)
             if 'processed_image' in request.FILES:
                 self.process_processed_image(instance)
 
@@ -207,18 +292,9 @@ class UpdateReceiptView(BaseView, generics.UpdateAPIView):
             logger.error(f"Error updating receipt {instance.pk}: {str(e)}", exc_info=True)
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    def reprocess_original_image(self, instance):
-        if instance.processed_image:
-            instance.processed_image.delete(save=False)
-
+    def reprocess_original_image(self, instance, prepared=None):
         try:
-            processed_image_file, instance.text = process_receipt_image(instance)
-            original_filename = instance.original_image.name.split('/')[-1]
-            processed_filename = 'processed_' + original_filename
-
-            instance.processed_image.save(processed_filename, processed_image_file)
-
-            save_receipt_text(instance)
+            store_processed_receipt(instance, prepared)
             logger.info(f"Reprocessed original image for receipt {instance.pk}")
         except Exception as e:
             logger.error(f"Image processing failed: {str(e)}", exc_info=True)
@@ -227,6 +303,9 @@ class UpdateReceiptView(BaseView, generics.UpdateAPIView):
     def process_processed_image(self, instance):
         try:
             instance.text = extract_text_from_image(instance.processed_image.path)
+            # The stored words belong to the previous processed image, reparsing them would undo this text.
+            if instance.ocr_words:
+                instance.ocr_words.delete(save=False)
 
             save_receipt_text(instance)
             logger.info(f"Processed image updated for receipt {instance.pk}")
@@ -235,6 +314,26 @@ class UpdateReceiptView(BaseView, generics.UpdateAPIView):
             raise ValidationError(f"Processing processed_image failed: {str(e)}")
 
 
+class ReceiptReparseView(BaseView, APIView):
+    """
+    Rebuilds the text and products of the user's receipts from their stored OCR words, all of them or
+    the ones listed in "ids", without running OCR again.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        self.log_request('ReceiptReparseView', request)
+        receipts = Receipt.objects.filter(user=request.user)
+
+        ids = request.data.get('ids')
+        if ids is not None:
+            if not isinstance(ids, list) or not all(isinstance(pk, int) and not isinstance(pk, bool) for pk in ids):
+                return Response({"error": "ids must be a list of receipt ids"}, status=status.HTTP_400_BAD_REQUEST)
+            receipts = receipts.filter(pk__in=ids)
+
+        return Response(reparse_receipts(receipts))
+
+
 class ShowReceiptImage(BaseView, APIView):
     permission_classes = [permissions.IsAuthenticated]
 
@@ -258,16 +357,32 @@ class ShowReceiptImage(BaseView, APIView):
             logger.warning(f"Image {filename} not found for receipt {pk}")
             return Response({'error': 'Image not found'}, status=status.HTTP_404_NOT_FOUND)
 
-        image_path = image_field.path
+        name = image_field.name
+        if 'width' in request.query_params or 'image_format' in request.query_params:
+            try:
+                width = snap_width(int(request.query_params.get('width', settings.RECEIPT_DERIVATIVE_WIDTHS[-1])))
+            except ValueError:
+                return Response({'error': 'Invalid width'}, status=status.HTTP_400_BAD_REQUEST)
+            image_format = request.query_params.get('image_format', settings.RECEIPT_DERIVATIVE_FORMAT)
+            if image_format not in DERIVATIVE_FORMATS:
+                return Response({'error': 'Invalid format'}, status=status.HTTP_400_BAD_REQUEST)
+
+            try:
+                name = get_derivative(image_field, width, image_format)
+                filename = name.split('/')[-1]
+            except IOError:
+                logger.error(f"Image file not found at {image_field.path}", exc_info=True)
+                return Response({'error': 'Image file not found'}, status=status.HTTP_404_NOT_FOUND)
+            except ValueError:
+                # An image OpenCV cannot scale is still served as stored, the browser may be able to show it.
+                logger.warning(f"Serving {filename} unscaled for receipt {pk}", exc_info=True)
+
         try:
-            with open(image_path, 'rb') as image_file:
-                mime_type, _ = mimetypes.guess_type(image_path)
-                response = HttpResponse(image_file.read(), content_type=mime_type)
-                response['Content-Disposition'] = f'inline; filename="{filename}"'
-                logger.info(f"Serving image {filename} for receipt {pk}")
-                return response
+            response = serve_file(request, name, filename)
+            logger.info(f"Serving image {filename} for receipt {pk} ({response.status_code})")
+            return response
         except IOError:
-            logger.error(f"Image file not found at {image_path}", exc_info=True)
+            logger.error(f"Image file not found at {image_field.path}", exc_info=True)
             return Response({'error': 'Image file not found'}, status=status.HTTP_404_NOT_FOUND)
 
 
@@ -359,31 +474,68 @@ class ChangePasswordView(APIView):
             )
 
 
-class ProductsByCategoryView(APIView):
+def stream_json_array(rows, chunk_rows=500):
+    # Same encoder and options as DRF's JSONRenderer, so a streamed body matches a rendered Response.
+    encoder = JSONEncoder(
+        ensure_ascii=not api_settings.UNICODE_JSON,
+        allow_nan=not api_settings.STRICT_JSON,
+        separators=(',', ':') if api_settings.COMPACT_JSON else (', ', ': ')
+    )
+    separator = encoder.item_separator
+    chunk = ['[']
+    for index, row in enumerate(rows):
+        chunk.append((separator if index else '') + encoder.encode(row))
+        if len(chunk) >= chunk_rows:
+            yield ''.join(chunk)
+            chunk = []
+    chunk.append(']')
+    yield ''.join(chunk)
+
+
+class ProductsByCategoryView(BaseView, APIView):
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = PriceKeysetPagination
 
-    def get(self, request, category, *args, **kwargs):
-        products = Product.objects.filter(
-            user=request.user,
+    def get_queryset(self, category):
+        # One joined query returning plain rows instead of a model instance and a receipt lookup per product.
+        return Product.objects.filter(
+            user=self.request.user,
             category=category
-        ).order_by('-price')
+        ).values(
+            'id', 'name', 'price',
+            receipt_title=F('receipt__title'),
+            receipt_date=F('receipt__date_of_shopping')
+        )
+
+    def not_found(self):
+        return Response(
+            {"error": "No products found for this category."},
+            status=status.HTTP_404_NOT_FOUND
+        )
 
-        if not products.exists():
-            return Response(
-                {"error": "No products found for this category."},
-                status=status.HTTP_404_NOT_FOUND
-            )
-
-        result = [
-            {
-                "id": product.id,
-                "name": product.name,
-                "price": product.price,
-                "receipt_title": product.receipt.title,
-                "receipt_date": product.receipt.date_of_shopping,
-            }
-            for product in products
-        ]
+    def get(self, request, category, *args, **kwargs):
+        self.log_request('ProductsByCategoryView', request)
+        paginator = self.pagination_class()
+        queryset = self.get_queryset(category)
+
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        if page is not None:
+            if not page and paginator.cursor_query_param not in request.query_params:
+                return self.not_found()
+            return paginator.get_paginated_response(page)
+
+        rows = paginator.order_queryset(queryset)
+        if request.query_params.get('stream', '').lower() in ('1', 'true', 'yes'):
+            rows = rows.iterator(chunk_size=settings.PRODUCT_STREAM_CHUNK_SIZE)
+            first = next(rows, None)
+            if first is None:
+                return self.not_found()
+            return StreamingHttpResponse(stream_json_array(itertools.chain([first], rows)),
+                                         content_type="application/json; charset=utf-8")
+
+        result = list(rows)
+        if not result:
+            return self.not_found()
         return Response(result, status=status.HTTP_200_OK, content_type="application/json; charset=utf-8")
 
 
@@ -430,4 +582,25 @@ class ProductsByReceiptView(APIView):
             )
 
         serializer = ProductSerializer(products, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK, content_type="application/json; charset=utf-8")
\ No newline at end of file
+        return Response(serializer.data, status=status.HTTP_200_OK, content_type="application/json; charset=utf-8")
+
+
+class MetricsScraperPermission(permissions.BasePermission):
+
+    def has_permission(self, request, view):
+        if request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS:
+            return True
+
+        token = settings.METRICS_TOKEN
+        scheme, _, credentials = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+        return bool(token) and scheme == 'Bearer' and hmac.compare_digest(credentials.encode(), token.encode())
+
+
+class MetricsView(APIView):
+    # A scraper holds a static token rather than a short lived JWT, and polls more often than the anonymous rate allows.
+    authentication_classes = []
+    throttle_classes = []
+    permission_classes = [MetricsScraperPermission]
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")